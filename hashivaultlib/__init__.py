@@ -32,8 +32,14 @@ Import all parts from hashivaultlib here
    http://google.github.io/styleguide/pyguide.html
 """
 from ._version import __version__
-from .hashivaultlib import Vault
+from .hashivaultlib import Vault, RestoreReport, RevocationReport, ConcurrencyLimiter, RetryPolicy
 from .hashivaultlibexceptions import InvalidPath
+from .asyncvault import AsyncVault
+from .backup import (BackupWriter, export_secrets, import_secrets, ArchiveWriter, BackupArchive, export_archive,
+                     BackupManifest)
+from .checkpoint import Checkpoint
+from .inventory import TokenInventory
+from .caching import TokenCache, ListingCache, SecretCache, PersistentCache
 
 __author__ = '''Costas Tyfoxylos <ctyfoxylos@schubergphilis.com>'''
 __docformat__ = '''google'''
@@ -49,4 +55,22 @@ assert __version__
 
 # assert objects
 assert Vault
+assert RestoreReport
+assert RevocationReport
+assert ConcurrencyLimiter
+assert RetryPolicy
 assert InvalidPath
+assert AsyncVault
+assert BackupWriter
+assert export_secrets
+assert import_secrets
+assert ArchiveWriter
+assert BackupArchive
+assert export_archive
+assert BackupManifest
+assert Checkpoint
+assert TokenInventory
+assert TokenCache
+assert ListingCache
+assert SecretCache
+assert PersistentCache
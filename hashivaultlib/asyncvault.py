@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: asyncvault.py
+#
+# Copyright 2018 Costas Tyfoxylos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Asynchronous client code for hashivaultlib.
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import asyncio
+import json
+import logging
+import os
+import ssl
+from collections import deque
+from functools import partial
+
+import aiohttp
+from hvac.exceptions import InvalidPath, VaultError
+from hvac.utils import raise_for_error
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+from .hashivaultlib import DEFAULT_MAX_WORKERS, RateLimiter, RestoreReport, RetryPolicy, TokenFactory, split_listing
+
+__author__ = '''Costas Tyfoxylos <ctyfoxylos@schubergphilis.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-05-25'''
+__copyright__ = '''Copyright 2018, Costas Tyfoxylos'''
+__credits__ = ["Costas Tyfoxylos"]
+__license__ = '''MIT'''
+__maintainer__ = '''Costas Tyfoxylos'''
+__email__ = '''<ctyfoxylos@schubergphilis.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''hashivaultlib'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class AsyncVault:  # pylint: disable=too-many-instance-attributes
+    """Asynchronous vault client running bulk operations on a single event loop over a pooled HTTP session."""
+
+    def __init__(self, url, token, max_workers=None, verify=True, namespace=None,  # pylint: disable=too-many-arguments
+                 keep_raw_token_data=False, retry_policy=None):
+        logger_name = u'{base}.{suffix}'.format(base=LOGGER_BASENAME,
+                                                suffix=self.__class__.__name__)
+        self._logger = logging.getLogger(logger_name)
+        self.url = url.rstrip('/')
+        self.token = token
+        self.max_workers = max_workers
+        self.verify = verify
+        self.namespace = namespace
+        self.keep_raw_token_data = keep_raw_token_data
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._session = None
+        self._semaphore = None
+
+    @property
+    def _concurrency(self):
+        return self.max_workers or DEFAULT_MAX_WORKERS
+
+    @property
+    def _headers(self):
+        headers = {'X-Vault-Token': self.token}
+        if self.namespace:
+            headers['X-Vault-Namespace'] = self.namespace
+        return headers
+
+    @property
+    def _ssl(self):
+        """The TLS verification of the connections, a CA bundle file or directory like hvac accepts for verify."""
+        if isinstance(self.verify, (str, os.PathLike)):
+            if os.path.isdir(self.verify):
+                return ssl.create_default_context(capath=self.verify)
+            return ssl.create_default_context(cafile=self.verify)
+        return None if self.verify else False
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._concurrency, ssl=self._ssl)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        return self._session
+
+    async def close(self):
+        """Closes the underlying HTTP session and releases its connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _request(self, operation, method, path, raise_exception=True, **kwargs):
+        """Makes a request to vault, retrying transient errors per the retry policy.
+
+        Args:
+            operation: The kind of the request for the retry policy, one of list, read, lookup, write, delete or revoke
+            method: The HTTP method of the request
+            path: The path of the request under the v1 API
+            raise_exception: Whether to raise for error responses or to return their data
+            **kwargs: The keyword arguments of the aiohttp request
+
+        Returns:
+            dict: The data of the response if any
+
+        """
+        try:
+            return await self.retry_policy.call_async(operation, partial(self._send, method, path, **kwargs))
+        except VaultError as error:
+            if raise_exception:
+                raise
+            return error.json
+
+    async def _send(self, method, path, **kwargs):
+        """Sends a single request, raising the errors of the synchronous client so the retry policy treats them alike."""
+        session = self._get_session()
+        url = '{host}/v1/{path}'.format(host=self.url, path=path)
+        try:
+            async with self._semaphore:
+                async with session.request(method, url, headers=self._headers, **kwargs) as response:
+                    text = await response.text()
+                    status = response.status
+                    data = json.loads(text) if text and response.content_type == 'application/json' else None
+        except asyncio.TimeoutError as error:
+            raise Timeout('Request to {} timed out'.format(url)) from error
+        except aiohttp.ClientConnectionError as error:
+            raise RequestsConnectionError(str(error)) from error
+        if status >= 400:
+            errors = data.get('errors') if data else None
+            raise_for_error(method, url, status, None if errors else text, errors=errors, text=text, json=data)
+        return data
+
+    async def read(self, path):
+        """Reads a path from vault.
+
+        Args:
+            path: The path to read
+
+        Returns:
+            dict: The response of vault if the path exists, None otherwise
+
+        """
+        try:
+            return await self._request('read', 'GET', path)
+        except InvalidPath:
+            return None
+
+    async def list(self, path):
+        """Lists a path in vault.
+
+        Args:
+            path: The path to list
+
+        Returns:
+            dict: The response of vault if the path can be listed, None otherwise
+
+        """
+        try:
+            return await self._request('list', 'GET', path, params={'list': 'true'})
+        except InvalidPath:
+            return None
+
+    async def write(self, path, **data):
+        """Writes data to a path in vault.
+
+        Args:
+            path: The path to write to
+            **data: The data to write
+
+        Returns:
+            dict: The response of vault if any
+
+        """
+        return await self._request('write', 'POST', path, json=data)
+
+    async def delete(self, path):
+        """Deletes a path from vault.
+
+        Args:
+            path: The path to delete
+
+        """
+        await self._request('delete', 'DELETE', path)
+
+    async def revoke_token(self, token, accessor=False):
+        """Revokes a token or the token of an accessor.
+
+        Args:
+            token: The token or accessor to revoke
+            accessor: Flag on whether the token provided is an accessor
+
+        """
+        if accessor:
+            await self._request('revoke', 'POST', 'auth/token/revoke-accessor', json={'accessor': token})
+        else:
+            await self._request('revoke', 'POST', 'auth/token/revoke', json={'token': token})
+
+    async def _walk(self, path, list_keys, handle_secret=None):
+        """Walks a tree of secrets breadth first keeping a bounded number of requests in flight.
+
+        Mirrors Vault._walk with coroutines instead of threads.
+
+        Args:
+            path: The path to start walking from
+            list_keys: Coroutine function returning the keys under a path or None if the path is not a directory
+            handle_secret: Coroutine function processing the secret under a path, returning None if there is none
+
+        Returns:
+            async generator: Tuples of path and the result of handle_secret (or None) for every secret found
+
+        """
+        frontier = deque([(list_keys, path)])
+        in_flight = {}
+        try:
+            while frontier or in_flight:
+                while frontier and len(in_flight) < self._concurrency:
+                    function, path_ = frontier.popleft()
+                    in_flight[asyncio.ensure_future(function(path_))] = (function, path_)
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    function, path_ = in_flight.pop(task)
+                    result = task.result()
+                    if function is handle_secret:
+                        if result is None:
+                            self._logger.warning('Secret %s disappeared before it could be processed', path_)
+                        else:
+                            yield path_, result
+                        continue
+                    leaves, directories = split_listing(path_, result)
+                    frontier.extend((list_keys, directory) for directory in directories)
+                    if handle_secret is None:
+                        for leaf in leaves:
+                            yield leaf, None
+                    else:
+                        frontier.extend((handle_secret, leaf) for leaf in leaves)
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def _run_bounded(self, function, items, rate_limit=None):
+        """Runs a coroutine function over items keeping a bounded number of calls in flight.
+
+        Args:
+            function: Coroutine function accepting a single item
+            items: Iterable of items to call the function with
+            rate_limit: Maximum number of calls to start per second, unlimited if not set
+
+        Returns:
+            async generator: Tuples of item and the completed task of its call, in completion order
+
+        """
+        items = iter(items)
+        limiter = RateLimiter(rate_limit) if rate_limit else None
+        in_flight = {}
+        try:
+            while True:
+                for item in items:
+                    if limiter:
+                        await asyncio.sleep(limiter.reserve())
+                    in_flight[asyncio.ensure_future(function(item))] = item
+                    if len(in_flight) >= self._concurrency:
+                        break
+                if not in_flight:
+                    break
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield in_flight.pop(task), task
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def _list_keys_v1(self, path):
+        response = await self.list(path)
+        return response.get('data', {}).get('keys') if response else None
+
+    async def _read_secret_v1(self, path):
+        self._logger.info('Extracting secret %s', path)
+        return await self.read(path)
+
+    async def _delete_secret_v1(self, path):
+        self._logger.info('Deleting secret %s', path)
+        await self.delete(path)
+        return path
+
+    async def delete_path(self, path):
+        """Deletes recursively a path from vault.
+
+        Args:
+            path: The path to remove
+
+        """
+        async for _ in self._walk(path, self._list_keys_v1, self._delete_secret_v1):
+            pass
+
+    async def iter_secrets_from_path(self, path):
+        """Iterates recursively over all the secrets from a path in vault.
+
+        Args:
+            path: The path to retrieve all the secrets for
+
+        Returns:
+            async generator: The secret dictionaries with the "original_path" attribute set
+
+        """
+        async for original_path, secret in self._walk(path, self._list_keys_v1, self._read_secret_v1):
+            secret['original_path'] = original_path
+            yield secret
+
+    async def retrieve_secrets_from_path(self, path):
+        """Retrieves recursively all the secrets from a path in vault.
+
+        Args:
+            path: The path to retrieve all the secrets for
+
+        Returns:
+            list: The secret dictionaries with the "original_path" attribute set
+
+        """
+        return [secret async for secret in self.iter_secrets_from_path(path)]
+
+    async def _list_keys_v2(self, path, mount_point):
+        response = await self.list('{mount_point}/metadata/{path}'.format(mount_point=mount_point, path=path))
+        return response.get('data', {}).get('keys') if response else None
+
+    async def _read_secret_v2(self, path, mount_point):
+        self._logger.info('Extracting secret %s', path)
+        return await self.read('{mount_point}/data/{path}'.format(mount_point=mount_point, path=path))
+
+    async def _delete_secret_v2(self, path, mount_point):
+        self._logger.info('Deleting %s', path)
+        await self.delete('{mount_point}/metadata/{path}'.format(mount_point=mount_point, path=path))
+        return path
+
+    async def delete_path_v2(self, path, mount_point):
+        """Deletes recursively a path from vault using v2 engine.
+
+        Args:
+            path: The path to remove
+            mount_point: Mountpoint for path
+
+        """
+        async for _ in self._walk(path,
+                                  partial(self._list_keys_v2, mount_point=mount_point),
+                                  partial(self._delete_secret_v2, mount_point=mount_point)):
+            pass
+
+    async def iter_keys_from_path_v2(self, path, mount_point):
+        """Iterates recursively over the paths of all the secrets under a path in vault using v2 engine.
+
+        Args:
+            path: The path to enumerate the secrets for
+            mount_point: Mountpoint for path
+
+        Returns:
+            async generator: The paths of the secrets
+
+        """
+        async for secret_path, _ in self._walk(path, partial(self._list_keys_v2, mount_point=mount_point)):
+            yield secret_path
+
+    async def iter_secrets_from_path_v2(self, path, mount_point):
+        """Iterates recursively over all the secrets from a path in vault using v2 engine.
+
+        Args:
+            path: The path to retrieve all the secrets for
+            mount_point: Mountpoint for path
+
+        Returns:
+            async generator: The secret dictionaries with the "original_path" attribute set
+
+        """
+        async for original_path, secret in self._walk(path,
+                                                      partial(self._list_keys_v2, mount_point=mount_point),
+                                                      partial(self._read_secret_v2, mount_point=mount_point)):
+            secret['original_path'] = original_path
+            yield secret
+
+    async def retrieve_secrets_from_path_v2(self, path, mount_point):
+        """Retrieves recursively all the secrets from a path in vault using v2 engine.
+
+        Args:
+            path: The path to retrieve all the secrets for
+            mount_point: Mountpoint for path
+
+        Returns:
+            list: The secret dictionaries with the "original_path" attribute set
+
+        """
+        return [secret async for secret in self.iter_secrets_from_path_v2(path, mount_point)]
+
+    async def _restore(self, secrets, write_secret, rate_limit):
+        if not RestoreReport.accepts(secrets):
+            self._logger.error('Please provide an iterable of secrets to restore.')
+            return False
+        report = RestoreReport()
+        async for secret, task in self._run_bounded(write_secret, report.restorable(secrets), rate_limit):
+            report.record(secret, task)
+        return report
+
+    async def _write_secret_v1(self, secret):
+        path = secret.get('original_path')
+        self._logger.info('Adding secrets to path %s', path)
+        await self._request('write', 'POST', path, json=secret.get('data'))
+
+    async def restore_secrets(self, secrets, rate_limit=None):
+        """Restores secrets to vault in their original path.
+
+        Args:
+            secrets: Iterable of secret dictionaries with "original_path" attribute set, consumed lazily so that it can
+                be a generator like the one of import_secrets
+            rate_limit: Maximum number of writes to start per second, unlimited if not set
+
+        Returns:
+            RestoreReport: The restored and failed secrets, evaluating to True if all succeeded, False on invalid input
+
+        """
+        return await self._restore(secrets, self._write_secret_v1, rate_limit)
+
+    async def _write_secret_v2(self, secret, mount_point):
+        path = secret.get('original_path')
+        self._logger.info('Adding secrets to path %s', path)
+        await self._request('write',
+                            'POST',
+                            '{mount_point}/data/{path}'.format(mount_point=mount_point, path=path),
+                            json={'data': secret.get('data', {}).get('data')})
+
+    async def restore_secrets_v2(self, secrets, mount_point, rate_limit=None):
+        """Restores secrets to vault in their original path using v2 engine.
+
+        Args:
+            secrets: Iterable of secret dictionaries with "original_path" attribute set, consumed lazily so that it can
+                be a generator like the one of import_secrets
+            mount_point: Mountpoint for path
+            rate_limit: Maximum number of writes to start per second, unlimited if not set
+
+        Returns:
+            RestoreReport: The restored and failed secrets, evaluating to True if all succeeded, False on invalid input
+
+        """
+        return await self._restore(secrets, partial(self._write_secret_v2, mount_point=mount_point), rate_limit)
+
+    async def _token_accessors(self):
+        response = await self._request('list',
+                                       'GET',
+                                       'auth/token/accessors',
+                                       raise_exception=False,
+                                       params={'list': 'true'})
+        if not response or 'errors' in response:
+            self._logger.error('Error retrieving accessors.')
+            return None
+        return response.get('data', {}).get('keys', [])
+
+    async def _lookup_accessor(self, accessor):
+        return await self._request('lookup', 'POST', 'auth/token/lookup-accessor', raise_exception=False,
+                                   json={'accessor': accessor})
+
+    @property
+    async def tokens(self):
+        """Models the tokens of a vault installation.
+
+        Returns:
+            async generator: All tokens of a vault in a Token object format
+
+        """
+        async for _, task in self._run_bounded(self._lookup_accessor, await self._token_accessors() or []):
+            try:
+                yield TokenFactory(self, task.result())
+            except Exception:  # pylint: disable=broad-except
+                self._logger.exception('Future failed...')
@@ -0,0 +1,526 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: backup.py
+#
+# Copyright 2018 Costas Tyfoxylos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Backup file code for hashivaultlib.
+
+Backups are JSON Lines files holding one secret per line, as retrieved with its "original_path", optionally compressed
+with gzip or zstd. The zstd compression requires the zstandard package.
+
+Differential backups of kv v2 mounts hold only the secrets that changed since a previous backup, as told by the
+BackupManifest saved with it, and a tombstone line with "original_path" and "deleted" set for every secret deleted since.
+
+Backup archives hold the same lines uncompressed followed by an index of the paths sorted, so that single secrets or
+subtrees can be looked up by binary search on the memory mapped file without reading the rest of it. Their layout is
+
+* the magic bytes
+* the lines of the secrets, in the order they were written
+* the paths, utf-8 encoded and concatenated in sorted order
+* an index entry per path with the offset and length of the path and of its line
+* a footer with the offsets of the paths and the index, the number of entries and the magic bytes
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import gzip
+import io
+import json
+import mmap
+import os
+import struct
+from pathlib import PurePath
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__author__ = '''Costas Tyfoxylos <ctyfoxylos@schubergphilis.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-05-25'''
+__copyright__ = '''Copyright 2018, Costas Tyfoxylos'''
+__credits__ = ["Costas Tyfoxylos"]
+__license__ = '''MIT'''
+__maintainer__ = '''Costas Tyfoxylos'''
+__email__ = '''<ctyfoxylos@schubergphilis.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# The compression used for a backup file when not provided, by the suffix of its name
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+
+# The attribute marking a tombstone, the line of a differential backup recording that a secret was deleted
+TOMBSTONE_ATTRIBUTE = 'deleted'
+
+# Marks the start and the end of a backup archive
+ARCHIVE_MAGIC = b'HVLARC01'
+
+# Offset and length of the path, offset and length of the line of a secret
+ARCHIVE_INDEX_ENTRY = struct.Struct('<QIQI')
+
+# Offset of the paths, offset of the index, number of entries and the magic bytes
+ARCHIVE_FOOTER = struct.Struct('<QQQ8s')
+
+
+def _compression(path, compression):
+    if compression is None:
+        return COMPRESSION_SUFFIXES.get(PurePath(os.fspath(path)).suffix)
+    if compression not in COMPRESSION_SUFFIXES.values():
+        raise ValueError('Unsupported compression {}, expected one of {}'.format(compression,
+                                                                                 sorted(COMPRESSION_SUFFIXES.values())))
+    return compression
+
+
+def open_backup(path, mode='r', compression=None):
+    """Opens a backup file as text.
+
+    Args:
+        path: The path of the file
+        mode: "r" to read, "w" to write or "a" to append
+        compression: "gzip" or "zstd", defaults to the one matching the suffix of the file name if any
+
+    Returns:
+        file: The text file object
+
+    """
+    compression = _compression(path, compression)
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('The zstandard package is required for zstd compressed backups')
+        file_ = open(path, mode + 'b')
+        if mode == 'r':
+            stream = zstandard.ZstdDecompressor().stream_reader(file_, read_across_frames=True, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(file_, closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class BackupWriter:
+    """Writes secrets to a backup file one at a time so that they never need to be held in memory together.
+
+    Every flush ends the compressed stream of a compressed file and the next write starts a new one, so that the file
+    can be read back up to the last flush even if the writer is never closed. Appending to a compressed file likewise
+    adds a new compressed stream after the existing ones.
+
+    Given a checkpoint the writer becomes its on_save hook, so that every save records the offset the backup was
+    flushed up to. The backup is appended to, after being truncated to the offset of the saved state, which drops the
+    secrets written after the last save, or truncated entirely without a saved state, in step with the walk resuming
+    from the same checkpoint.
+
+    """
+
+    def __init__(self, path, compression=None, append=False, checkpoint=None):
+        self.path = path
+        self.count = 0
+        self._compression = _compression(path, compression)
+        if self._compression == 'zstd' and zstandard is None:
+            raise ImportError('The zstandard package is required for zstd compressed backups')
+        self._file = open(path, 'ab' if append or checkpoint is not None else 'wb')
+        if checkpoint is not None:
+            self._file.truncate(checkpoint.offset or 0)
+            checkpoint.on_save = self.flush
+        self._stream = None
+
+    def _open_stream(self):
+        if self._compression == 'gzip':
+            return gzip.GzipFile(fileobj=self._file, mode='wb')
+        if self._compression == 'zstd':
+            return zstandard.ZstdCompressor().stream_writer(self._file, closefd=False)
+        return self._file
+
+    def _close_stream(self):
+        if self._stream is not None and self._stream is not self._file:
+            self._stream.close()
+        self._stream = None
+
+    def write(self, secret):
+        """Writes a secret as a line of the backup.
+
+        Args:
+            secret: The secret dictionary with the "original_path" attribute set
+
+        """
+        record = dict(secret)
+        if record.get('original_path') is not None:
+            record['original_path'] = str(record['original_path'])
+        if self._stream is None:
+            self._stream = self._open_stream()
+        self._stream.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+        self.count += 1
+
+    def flush(self):
+        """Ends the compressed stream and flushes the secrets written so far to disk, the on_save hook of a Checkpoint.
+
+        Returns:
+            int: The size of the file, up to which it holds complete compressed streams
+
+        """
+        self._close_stream()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return os.fstat(self._file.fileno()).st_size
+
+    def close(self):
+        """Closes the file, completing its compressed stream."""
+        self._close_stream()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def export_secrets(secrets, path, compression=None, append=False):
+    """Streams secrets to a backup file as they arrive.
+
+    Args:
+        secrets: Iterable of secret dictionaries with the "original_path" attribute set, like the generator returned by
+            iter_secrets_from_path
+        path: The path of the backup file
+        compression: "gzip" or "zstd", defaults to the one matching the suffix of the file name if any
+        append: Flag on whether to append to an existing backup instead of replacing it
+
+    Returns:
+        int: The number of secrets written
+
+    """
+    with BackupWriter(path, compression, append) as writer:
+        for secret in secrets:
+            writer.write(secret)
+    return writer.count
+
+
+def import_secrets(path, compression=None):
+    """Streams secrets from a backup file one at a time, ready to be passed on to restore_secrets.
+
+    Args:
+        path: The path of the backup file
+        compression: "gzip" or "zstd", defaults to the one matching the suffix of the file name if any
+
+    Returns:
+        generator: The secret dictionaries with the "original_path" attribute set
+
+    """
+    with open_backup(path, 'r', compression) as backup:
+        for line in backup:
+            if line.strip():
+                yield json.loads(line)
+
+
+class BackupManifest:
+    """Records the current version and update time of every secret in a kv v2 backup, to tell what changed since.
+
+    Saved as a JSON file next to every backup and passed on to the next differential backup, which updates it.
+
+    """
+
+    def __init__(self, entries=None):
+        self._entries = dict(entries or {})
+
+    @classmethod
+    def load(cls, path):
+        """Loads a manifest from a file.
+
+        Args:
+            path: The path of the manifest file
+
+        Returns:
+            BackupManifest: The manifest, empty if the file does not exist so that the first backup is a full one
+
+        """
+        try:
+            with open(path, encoding='utf-8') as manifest:
+                return cls(json.load(manifest))
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path):
+        """Saves the manifest to a file atomically.
+
+        Args:
+            path: The path of the manifest file
+
+        """
+        temporary = '{}.tmp'.format(os.fspath(path))
+        with open(temporary, 'w', encoding='utf-8') as manifest:
+            json.dump(self._entries, manifest)
+        os.replace(temporary, path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return str(path) in self._entries
+
+    def paths(self, root=None):
+        """Lists the paths of the recorded secrets.
+
+        Args:
+            root: Only list the paths under this path if provided
+
+        Returns:
+            list: The paths of the secrets
+
+        """
+        if root is None or str(root).strip('/.') == '':
+            return list(self._entries)
+        root = str(root).rstrip('/')
+        prefix = '{}/'.format(root)
+        return [path for path in self._entries if path == root or path.startswith(prefix)]
+
+    def is_current(self, path, version, updated_time):
+        """Tells whether a secret is unchanged since it was recorded.
+
+        Args:
+            path: The path of the secret
+            version: The current version of the secret
+            updated_time: The time the metadata of the secret was last updated
+
+        Returns:
+            bool: True if the secret is recorded with the same version and update time, False otherwise
+
+        """
+        return self._entries.get(str(path)) == [version, updated_time]
+
+    def update(self, path, version, updated_time):
+        """Records the current version and update time of a secret.
+
+        Args:
+            path: The path of the secret
+            version: The current version of the secret
+            updated_time: The time the metadata of the secret was last updated
+
+        """
+        self._entries[str(path)] = [version, updated_time]
+
+    def remove(self, path):
+        """Forgets a deleted secret.
+
+        Args:
+            path: The path of the secret
+
+        """
+        self._entries.pop(str(path), None)
+
+
+class ArchiveWriter:
+    """Writes secrets to a backup archive one at a time, keeping only their paths and offsets in memory for the index.
+
+    A path written more than once keeps its last secret and a tombstone drops it, so writing a full backup followed by
+    its differential ones consolidates them. The index is written when the writer is closed. A writer left by an
+    exception is aborted instead, so that the archive lacks its footer and is rejected by BackupArchive.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(ARCHIVE_MAGIC)
+        self._offsets = {}
+
+    @property
+    def count(self):
+        """The number of distinct secrets written."""
+        return len(self._offsets)
+
+    def write(self, secret):
+        """Writes a secret to the archive.
+
+        Args:
+            secret: The secret dictionary with the "original_path" attribute set
+
+        """
+        path = secret.get('original_path')
+        if not path:
+            raise ValueError('No "original_path" found, cannot archive.')
+        if secret.get(TOMBSTONE_ATTRIBUTE):
+            self._offsets.pop(str(path).encode('utf-8'), None)
+            return
+        record = dict(secret)
+        record['original_path'] = str(path)
+        line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+        self._offsets[record['original_path'].encode('utf-8')] = (self._file.tell(), len(line))
+        self._file.write(line)
+
+    def close(self):
+        """Writes the index and the footer and closes the file."""
+        if self._file.closed:
+            return
+        paths = sorted(self._offsets)
+        paths_offset = self._file.tell()
+        path_offsets = []
+        for path in paths:
+            path_offsets.append(self._file.tell())
+            self._file.write(path)
+        index_offset = self._file.tell()
+        for path, path_offset in zip(paths, path_offsets):
+            self._file.write(ARCHIVE_INDEX_ENTRY.pack(path_offset, len(path), *self._offsets[path]))
+        self._file.write(ARCHIVE_FOOTER.pack(paths_offset, index_offset, len(paths), ARCHIVE_MAGIC))
+        self._file.close()
+
+    def abort(self):
+        """Closes the file without the index and the footer, leaving an archive that cannot be opened."""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class BackupArchive:
+    """Reads secrets from a backup archive by path, memory mapping the file so that only what is looked up is read."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file_:
+            self._map = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < len(ARCHIVE_MAGIC) + ARCHIVE_FOOTER.size or self._map[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+            self._map.close()
+            raise ValueError('{} is not a backup archive'.format(path))
+        _, self._index_offset, self._count, magic = ARCHIVE_FOOTER.unpack_from(self._map,
+                                                                               len(self._map) - ARCHIVE_FOOTER.size)
+        if magic != ARCHIVE_MAGIC:
+            self._map.close()
+            raise ValueError('{} is an incomplete backup archive'.format(path))
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, position):
+        return ARCHIVE_INDEX_ENTRY.unpack_from(self._map, self._index_offset + position * ARCHIVE_INDEX_ENTRY.size)
+
+    def _path(self, position):
+        path_offset, path_length, _, _ = self._entry(position)
+        return self._map[path_offset:path_offset + path_length]
+
+    def _secret(self, position):
+        _, _, line_offset, line_length = self._entry(position)
+        return json.loads(self._map[line_offset:line_offset + line_length])
+
+    def _bisect(self, path):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._path(middle) < path:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def paths(self):
+        """Iterates over the paths of the secrets in the archive in sorted order.
+
+        Returns:
+            generator: The paths of the secrets
+
+        """
+        for position in range(self._count):
+            yield self._path(position).decode('utf-8')
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def get(self, path):
+        """Looks up a single secret.
+
+        Args:
+            path: The original path of the secret
+
+        Returns:
+            dict: The secret dictionary with the "original_path" attribute set, None if it is not in the archive
+
+        """
+        path = str(path).encode('utf-8')
+        position = self._bisect(path)
+        if position < self._count and self._path(position) == path:
+            return self._secret(position)
+        return None
+
+    def subtree(self, path=None):
+        """Iterates over the secret stored at a path and all the secrets under it, in sorted order.
+
+        Args:
+            path: The path of the subtree, all the secrets of the archive if not provided
+
+        Returns:
+            generator: The secret dictionaries with the "original_path" attribute set, ready to be passed on to
+                restore_secrets
+
+        """
+        if not path:
+            for position in range(self._count):
+                yield self._secret(position)
+            return
+        path = str(path).rstrip('/')
+        secret = self.get(path)
+        if secret is not None:
+            yield secret
+        prefix = '{}/'.format(path).encode('utf-8')
+        position = self._bisect(prefix)
+        while position < self._count and self._path(position).startswith(prefix):
+            yield self._secret(position)
+            position += 1
+
+    def close(self):
+        """Unmaps the archive."""
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def export_archive(secrets, path):
+    """Streams secrets to a backup archive as they arrive.
+
+    If iterating the secrets fails the archive is left without its footer, so that BackupArchive rejects it.
+
+    Args:
+        secrets: Iterable of secret dictionaries with the "original_path" attribute set, like the generator returned by
+            iter_secrets_from_path or import_secrets
+        path: The path of the backup archive
+
+    Returns:
+        int: The number of distinct secrets written
+
+    """
+    with ArchiveWriter(path) as writer:
+        for secret in secrets:
+            writer.write(secret)
+    return writer.count
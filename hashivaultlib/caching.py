@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: caching.py
+#
+# Copyright 2018 Costas Tyfoxylos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Caching code for hashivaultlib.
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+from pathlib import PurePosixPath
+
+__author__ = '''Costas Tyfoxylos <ctyfoxylos@schubergphilis.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-05-25'''
+__copyright__ = '''Copyright 2018, Costas Tyfoxylos'''
+__credits__ = ["Costas Tyfoxylos"]
+__license__ = '''MIT'''
+__maintainer__ = '''Costas Tyfoxylos'''
+__email__ = '''<ctyfoxylos@schubergphilis.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+class TokenCache:
+    """Caches token lookups by accessor until the token expires.
+
+    A lookup reports the seconds the token has left in its ttl, so an entry is fresh until that ttl has run out, at
+    which point the token is either gone or has been renewed. Tokens without a ttl never go stale unless max_age is
+    set. The ttl of a cached lookup is counted down when it is served.
+
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, accessor):
+        return accessor in self._entries
+
+    def _is_fresh(self, entry, now):
+        _, fetched_at, expires_at = entry
+        if expires_at is not None and now >= expires_at:
+            return False
+        return not (self.max_age is not None and now - fetched_at >= self.max_age)
+
+    def get(self, accessor, now=None):
+        """Retrieves the cached lookup of an accessor.
+
+        Args:
+            accessor: The accessor of the token
+            now: The POSIX timestamp to evaluate freshness at, defaults to the current time
+
+        Returns:
+            dict: The lookup response with its ttl counted down if it is cached and fresh, None otherwise
+
+        """
+        now = time.time() if now is None else now
+        return self._serve(self._entries.get(accessor), now)
+
+    def _serve(self, entry, now):
+        if entry is None or not self._is_fresh(entry, now):
+            return None
+        data, _, expires_at = entry
+        if expires_at is None:
+            return data
+        return dict(data, data=dict(data.get('data') or {}, ttl=int(expires_at - now)))
+
+    def set(self, accessor, data, now=None):
+        """Caches the lookup of an accessor.
+
+        Args:
+            accessor: The accessor of the token
+            data: The lookup response of the token
+            now: The POSIX timestamp of the lookup, defaults to the current time
+
+        """
+        now = time.time() if now is None else now
+        ttl = (data.get('data') or {}).get('ttl')
+        with self._lock:
+            self._entries[accessor] = (data, now, now + ttl if ttl else None)
+
+    def discard(self, accessor):
+        """Removes the lookup of an accessor from the cache if present.
+
+        Args:
+            accessor: The accessor of the token
+
+        """
+        with self._lock:
+            self._entries.pop(accessor, None)
+
+    def retain(self, accessors):
+        """Evicts the lookups of all accessors that do not exist anymore.
+
+        Args:
+            accessors: The accessors that currently exist
+
+        """
+        accessors = set(accessors)
+        with self._lock:
+            for accessor in [accessor for accessor in self._entries if accessor not in accessors]:
+                del self._entries[accessor]
+
+
+class ListingCache:
+    """Caches directory listings in memory with a bounded size, least recently used eviction and expiry.
+
+    Invalidating a path drops its own listing and its ancestors' right away, while its descendants' listings are
+    dropped when they are next looked up, which keeps invalidation cheap no matter how many listings are cached.
+
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._invalidations = OrderedDict()
+        self._ticks = count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _is_expired(self, created_at, now):
+        return self.ttl is not None and now - created_at >= self.ttl
+
+    def get_listing(self, path):
+        """Retrieves the cached keys of a directory.
+
+        Args:
+            path: The path of the directory as requested from vault
+
+        Returns:
+            list: The keys of the directory if cached and fresh, None otherwise
+
+        """
+        path = str(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            keys, tick, created_at = entry
+            invalidated = any(self._invalidations.get(parent, (-1,))[0] > tick
+                              for parent in _listing_family(path)[1:])
+            if invalidated or self._is_expired(created_at, time.monotonic()):
+                del self._entries[path]
+                return None
+            self._entries.move_to_end(path)
+            return keys
+
+    def set_listing(self, path, keys):
+        """Caches the keys of a directory, evicting the least recently used listings beyond max_size.
+
+        Args:
+            path: The path of the directory as requested from vault
+            keys: The keys of the directory
+
+        """
+        path = str(path)
+        with self._lock:
+            self._entries[path] = (keys, next(self._ticks), time.monotonic())
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_listing(self, path):
+        """Drops the cached listings a change under a path affects, its own, its ancestors' and its descendants'.
+
+        Args:
+            path: The path that changed
+
+        """
+        family = _listing_family(path)
+        now = time.monotonic()
+        with self._lock:
+            if family[0] == '.':
+                self._clear()
+                return
+            for path_ in family:
+                self._entries.pop(path_, None)
+            self._invalidations[family[0]] = (next(self._ticks), now)
+            self._invalidations.move_to_end(family[0])
+            while self._invalidations and self._is_expired(next(iter(self._invalidations.values()))[1], now):
+                self._invalidations.popitem(last=False)
+            if len(self._invalidations) > self.max_size:
+                self._clear()
+
+    def _clear(self):
+        self._entries.clear()
+        self._invalidations.clear()
+
+    def clear(self):
+        """Drops all cached listings."""
+        with self._lock:
+            self._clear()
+
+
+class SecretCache:
+    """Caches kv v2 secret reads in memory with a bounded size, least recently used eviction and expiry.
+
+    Once an entry is older than ttl it is stale. With revalidate set a stale entry is checked against the
+    current_version of the secret's metadata and kept if it still matches, which saves transferring and decrypting
+    the secret.
+
+    """
+
+    def __init__(self, max_size=1000, ttl=60, revalidate=True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.revalidate = revalidate
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Retrieves a cached secret.
+
+        Args:
+            key: The key of the secret
+
+        Returns:
+            tuple: The cached read response or None, and a flag on whether it is still fresh
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False
+            self._entries.move_to_end(key)
+        response, cached_at = entry
+        return response, self.ttl is None or time.monotonic() - cached_at < self.ttl
+
+    def set(self, key, response):
+        """Caches a secret, evicting the least recently used secrets beyond max_size.
+
+        Args:
+            key: The key of the secret
+            response: The read response of the secret
+
+        """
+        with self._lock:
+            self._entries[key] = (response, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def refresh(self, key):
+        """Marks a cached secret as fresh again after it has been revalidated.
+
+        Args:
+            key: The key of the secret
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], time.monotonic())
+
+    def invalidate(self, key):
+        """Drops a cached secret.
+
+        Args:
+            key: The key of the secret
+
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+def _listing_family(path):
+    """The listing itself and all its ancestors, which all change when something under the path changes."""
+    path = PurePosixPath(path)
+    return [str(path)] + [str(parent) for parent in path.parents]
+
+
+class PersistentCache(TokenCache):
+    """Caches token lookups and directory listings in an SQLite database so they survive between runs.
+
+    It can be passed to Vault both as the token cache and as the listing cache. Token lookups follow the freshness
+    rules of TokenCache while listings are fresh for listing_max_age seconds, five minutes by default. Writes made
+    through the library invalidate the listings they affect, but secrets created or deleted by other clients are not
+    seen until the cached listing expires, so a traversal or a recursive delete can miss them for up to listing_max_age
+    seconds. Setting it to None keeps listings forever, which only suits mounts that nothing else writes to. Fields of
+    the token lookups in exclude_token_fields, by default the token id, are never written to disk. Writes are committed
+    in batches, on flush and on close.
+
+    """
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 path,
+                 max_age=None,
+                 listing_max_age=300,
+                 exclude_token_fields=('id',),
+                 batch_size=1000):
+        super().__init__(max_age=max_age)
+        self.listing_max_age = listing_max_age
+        self.exclude_token_fields = tuple(exclude_token_fields or ())
+        self.batch_size = batch_size
+        self._pending = 0
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS tokens '
+                                     '(accessor TEXT PRIMARY KEY, data TEXT, fetched_at REAL, expires_at REAL)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS listings '
+                                     '(path TEXT PRIMARY KEY, keys TEXT, fetched_at REAL)')
+            self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM tokens').fetchone()[0]
+
+    def __contains__(self, accessor):
+        with self._lock:
+            row = self._connection.execute('SELECT 1 FROM tokens WHERE accessor = ?', (accessor,)).fetchone()
+        return row is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _execute(self, *statements):
+        with self._lock:
+            for statement, parameters in statements:
+                self._connection.execute(statement, parameters)
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._connection.commit()
+                self._pending = 0
+
+    def flush(self):
+        """Commits all pending writes to disk."""
+        with self._lock:
+            self._connection.commit()
+            self._pending = 0
+
+    def close(self):
+        """Commits all pending writes and closes the database."""
+        self.flush()
+        self._connection.close()
+
+    def get(self, accessor, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            row = self._connection.execute('SELECT data, fetched_at, expires_at FROM tokens WHERE accessor = ?',
+                                           (accessor,)).fetchone()
+        return self._serve((json.loads(row[0]), row[1], row[2]) if row else None, now)
+
+    def set(self, accessor, data, now=None):
+        now = time.time() if now is None else now
+        ttl = (data.get('data') or {}).get('ttl')
+        if self.exclude_token_fields:
+            data = dict(data, data={key: value for key, value in (data.get('data') or {}).items()
+                                    if key not in self.exclude_token_fields})
+        self._execute(('INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?)',
+                       (accessor, json.dumps(data), now, now + ttl if ttl else None)))
+
+    def discard(self, accessor):
+        self._execute(('DELETE FROM tokens WHERE accessor = ?', (accessor,)))
+
+    def retain(self, accessors):
+        with self._lock:
+            self._connection.execute('CREATE TEMP TABLE IF NOT EXISTS current_accessors (accessor TEXT PRIMARY KEY)')
+            self._connection.execute('DELETE FROM current_accessors')
+            self._connection.executemany('INSERT OR IGNORE INTO current_accessors VALUES (?)',
+                                         ((accessor,) for accessor in accessors))
+            self._connection.execute('DELETE FROM tokens WHERE accessor NOT IN (SELECT accessor FROM current_accessors)')
+            self._connection.commit()
+            self._pending = 0
+
+    def get_listing(self, path, now=None):
+        """Retrieves the cached keys of a directory.
+
+        Args:
+            path: The path of the directory as requested from vault
+            now: The POSIX timestamp to evaluate freshness at, defaults to the current time
+
+        Returns:
+            list: The keys of the directory if cached and fresh, None otherwise
+
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            row = self._connection.execute('SELECT keys, fetched_at FROM listings WHERE path = ?',
+                                           (str(path),)).fetchone()
+        if row is None or (self.listing_max_age is not None and now - row[1] >= self.listing_max_age):
+            return None
+        return json.loads(row[0])
+
+    def set_listing(self, path, keys, now=None):
+        """Caches the keys of a directory.
+
+        Args:
+            path: The path of the directory as requested from vault
+            keys: The keys of the directory
+            now: The POSIX timestamp of the listing, defaults to the current time
+
+        """
+        now = time.time() if now is None else now
+        self._execute(('INSERT OR REPLACE INTO listings VALUES (?, ?, ?)', (str(path), json.dumps(keys), now)))
+
+    def invalidate_listing(self, path):
+        """Drops the cached listings a change under a path affects, its own, its ancestors' and its descendants'.
+
+        Args:
+            path: The path that changed
+
+        """
+        family = _listing_family(path)
+        if family[0] == '.':
+            self._execute(('DELETE FROM listings', ()))
+            return
+        self._execute(*[('DELETE FROM listings WHERE path = ?', (path_,)) for path_ in family],
+                      ('DELETE FROM listings WHERE path > ? AND path < ?', (family[0] + '/', family[0] + '0')))
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: checkpoint.py
+#
+# Copyright 2018 Costas Tyfoxylos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Checkpointing code for hashivaultlib.
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import json
+import logging
+import os
+import time
+from collections import deque
+from pathlib import PurePosixPath
+
+__author__ = '''Costas Tyfoxylos <ctyfoxylos@schubergphilis.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-05-25'''
+__copyright__ = '''Copyright 2018, Costas Tyfoxylos'''
+__credits__ = ["Costas Tyfoxylos"]
+__license__ = '''MIT'''
+__maintainer__ = '''Costas Tyfoxylos'''
+__email__ = '''<ctyfoxylos@schubergphilis.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''hashivaultlib'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class Checkpoint:
+    """Persists the progress of a recursive traversal to a file so that a restarted traversal continues from it.
+
+    The state holds the starting path, the directories still to list, the secrets still to process and the secrets
+    already processed. It is written atomically, at most once per interval while the traversal runs and once more
+    when it stops early, and the file is removed when the traversal completes. The on_save callable, like the flush of
+    a BackupWriter, is called before every save so that whatever the consumer wrote for the completed secrets is on
+    disk before they are recorded as completed. The offset it returns, if any, is saved along with the state so that
+    whatever the consumer wrote after it can be dropped when the traversal resumes.
+
+    """
+
+    def __init__(self, path, interval=30, on_save=None):
+        logger_name = u'{base}.{suffix}'.format(base=LOGGER_BASENAME,
+                                                suffix=self.__class__.__name__)
+        self._logger = logging.getLogger(logger_name)
+        self.path = os.fspath(path)
+        self.interval = interval
+        self.on_save = on_save
+        self._saved_at = time.monotonic()
+
+    def load(self, root):
+        """Loads the state of an interrupted traversal.
+
+        Args:
+            root: The path the traversal starts from, which has to match the one of the saved state
+
+        Returns:
+            dict: The state with the "directories", "secrets" and "completed" lists of paths, None if there is none
+
+        """
+        try:
+            with open(self.path, encoding='utf-8') as checkpoint:
+                state = json.load(checkpoint)
+        except FileNotFoundError:
+            return None
+        if state.get('root') != str(root):
+            raise ValueError('Checkpoint {} was saved for path {} and not for {}'.format(self.path,
+                                                                                         state.get('root'),
+                                                                                         root))
+        self._logger.info('Resuming from checkpoint %s with %s directories and %s secrets pending, %s completed',
+                          self.path, len(state['directories']), len(state['secrets']), len(state['completed']))
+        return state
+
+    @property
+    def offset(self):
+        """The offset returned by the on_save callable for the saved state, None if there is none."""
+        try:
+            with open(self.path, encoding='utf-8') as checkpoint:
+                return json.load(checkpoint).get('offset')
+        except FileNotFoundError:
+            return None
+
+    @property
+    def due(self):
+        """Whether the interval since the state was last saved has passed."""
+        return time.monotonic() - self._saved_at >= self.interval
+
+    def save(self, state):
+        """Saves a state atomically, replacing the previous one.
+
+        Args:
+            state: The dictionary with the "root", "directories", "secrets" and "completed" entries
+
+        """
+        offset = self.on_save() if self.on_save is not None else None
+        if offset is not None:
+            state = dict(state, offset=offset)
+        temporary = '{}.tmp'.format(self.path)
+        with open(temporary, 'w', encoding='utf-8') as checkpoint:
+            json.dump(state, checkpoint)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(temporary, self.path)
+        self._saved_at = time.monotonic()
+        self._logger.debug('Saved checkpoint %s', self.path)
+
+    def clear(self):
+        """Removes the saved state once the traversal has completed."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class WalkProgress:
+    """Keeps the bookkeeping of a walk of a tree of secrets for its checkpoint, doing nothing without one.
+
+    Pending work is kept by the walk as tuples of the callable to run and the path to run it on, where the callable
+    listing directories tells them apart from secrets. The completed secrets are only remembered with a checkpoint, so
+    that a walk without one does not hold every path of the tree in memory.
+
+    """
+
+    def __init__(self, checkpoint, root, list_keys, handle_secret):
+        self.checkpoint = checkpoint
+        self.root = root
+        self.list_keys = list_keys
+        self.handle_secret = handle_secret
+        self._completed = set()
+
+    def resume(self):
+        """Returns the pending work and the secrets ready to yield, from the checkpoint if it has a state.
+
+        Returns:
+            tuple: The deque of pending work and the deque of secret paths ready to yield
+
+        """
+        state = self.checkpoint.load(self.root) if self.checkpoint is not None else None
+        if state is None:
+            return deque([(self.list_keys, self.root)]), deque()
+        self._completed.update(state['completed'])
+        frontier = deque((self.list_keys, PurePosixPath(directory)) for directory in state['directories'])
+        secrets = (PurePosixPath(secret) for secret in state['secrets'])
+        if self.handle_secret is None:
+            return frontier, deque(secrets)
+        frontier.extend((self.handle_secret, secret) for secret in secrets)
+        return frontier, deque()
+
+    @property
+    def due(self):
+        """Whether there is a checkpoint that should be saved."""
+        return self.checkpoint is not None and self.checkpoint.due
+
+    def complete(self, path):
+        """Records that the consumer is done with a secret."""
+        if self.checkpoint is not None:
+            self._completed.add(str(path))
+
+    def schedule(self, leaves, frontier, ready):
+        """Queues the secrets of a listing that were not completed before the walk was resumed.
+
+        Args:
+            leaves: The paths of the secrets of the listing
+            frontier: The deque of pending work, where secrets go to be handled
+            ready: The deque of secret paths ready to yield, where secrets go without a handle_secret callable
+
+        """
+        if self.checkpoint is not None:
+            leaves = [leaf for leaf in leaves if str(leaf) not in self._completed]
+        if self.handle_secret is None:
+            ready.extend(leaves)
+        else:
+            frontier.extend((self.handle_secret, leaf) for leaf in leaves)
+
+    def save(self, pending, ready):
+        """Saves the state of the walk to the checkpoint if there is one.
+
+        Args:
+            pending: Iterable of the tuples of callable and path still to run, including the ones in flight
+            ready: Iterable of the secret paths ready to yield
+
+        """
+        if self.checkpoint is None:
+            return
+        pending = list(pending)
+        self.checkpoint.save({'root': str(self.root),
+                              'directories': [str(path) for function, path in pending if function is self.list_keys],
+                              'secrets': ([str(path) for function, path in pending if function is not self.list_keys] +
+                                          [str(path) for path in ready]),
+                              'completed': sorted(self._completed)})
+
+    def finish(self):
+        """Clears the checkpoint if there is one, once the walk has completed."""
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
@@ -31,14 +31,34 @@ Main code for hashivaultlib.
 
 """
 
+# pylint: disable=too-many-lines
+
+import asyncio
 import concurrent.futures
 import json
 import logging
-from datetime import timedelta
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+from itertools import islice
 from pathlib import PurePosixPath
 from dateutil.parser import parse
 from hvac import Client
-from hvac.exceptions import InvalidPath
+from hvac.utils import raise_for_error
+from hvac.api.secrets_engines.kv_v2 import DEFAULT_MOUNT_POINT
+from hvac.exceptions import BadGateway, InternalServerError, InvalidPath, RateLimitExceeded, VaultDown
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, ConnectTimeout, Timeout
+
+from .backup import TOMBSTONE_ATTRIBUTE
+from .checkpoint import Checkpoint, WalkProgress
+from .inventory import TokenInventory
 
 
 __author__ = '''Costas Tyfoxylos <ctyfoxylos@schubergphilis.com>'''
@@ -57,22 +77,315 @@ LOGGER_BASENAME = '''hashivaultlib'''
 LOGGER = logging.getLogger(LOGGER_BASENAME)
 LOGGER.addHandler(logging.NullHandler())
 
+# Vault reports times in RFC 3339, with up to nanosecond precision
+RFC3339_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})[Tt ](\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?'
+                             r'(?:([Zz])|([+-])(\d{2}):(\d{2}))$')
+
+# Errors worth retrying since they are caused by the state of the server or the network and not by the request
+TRANSIENT_ERRORS = (BadGateway, InternalServerError, RateLimitExceeded, VaultDown, RequestsConnectionError, Timeout)
+
+# HTTP statuses by which vault signals that it is overloaded, on top of which timeouts and rising latency are also
+# taken as such
+OVERLOAD_STATUS_CODES = frozenset({429, 500, 502, 503})
+
+# The seconds over which the lowest latency of an operation is taken as its baseline, so that the baseline recovers
+# when vault gets slower for good
+BASELINE_WINDOW = 60.0
+
+# The lowest baseline latency in seconds, so that the jitter of a very fast vault is not taken for overload
+MINIMUM_BASELINE_LATENCY = 0.005
+
+# Transient errors for which vault surely did not process the request, so even requests that are not idempotent can
+# be repeated after them
+UNPROCESSED_ERRORS = (RateLimitExceeded, VaultDown, ConnectTimeout)
+
+# Operations that have the same effect however many times they are repeated
+IDEMPOTENT_OPERATIONS = frozenset({'list', 'read', 'lookup', 'delete'})
+
+# The error vault returns when looking up the accessor of a token that expired or was revoked
+INVALID_ACCESSOR_ERROR = 'invalid accessor'
+
+# The seconds to wait before the first retry, doubling on every next one
+RETRY_BACKOFF = 0.5
+
+# Marks a lazily parsed value that has not been parsed yet
+_UNPARSED = object()
+
+# Marks a secret whose current version is deleted or destroyed, which a differential backup records as a tombstone
+_DELETED = object()
 
-class Vault(Client):
+# The number of requests kept in flight when max_workers is not provided, same as the ThreadPoolExecutor default
+DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+class Vault(Client):  # pylint: disable=too-many-instance-attributes
     """Extends the hvac client for vault with some extra handy usability."""
 
-    def __init__(self, *args, max_workers=None, **kwargs):
+    def __init__(self,
+                 *args,
+                 max_workers=None,
+                 keep_raw_token_data=False,
+                 token_cache=None,
+                 listing_cache=None,
+                 secret_cache=None,
+                 coalesce_reads=False,
+                 concurrency_limiter=None,
+                 retry_policy=None,
+                 **kwargs):
         super().__init__(*args, **kwargs)
         logger_name = u'{base}.{suffix}'.format(base=LOGGER_BASENAME,
                                                 suffix=self.__class__.__name__)
         self._logger = logging.getLogger(logger_name)
         self.secrets.kv.v1.delete_path = self.delete_path
         self.secrets.kv.v1.retrieve_secrets_from_path = self.retrieve_secrets_from_path
+        self.secrets.kv.v1.iter_secrets_from_path = self.iter_secrets_from_path
         self.secrets.kv.v1.restore_secrets = self.restore_secrets
         self.secrets.kv.v2.delete_path = self._delete_path_v2
         self.secrets.kv.v2.retrieve_secrets_from_path = self._retrieve_secrets_from_path_v2
+        self.secrets.kv.v2.iter_secrets_from_path = self._iter_secrets_from_path_v2
+        self.secrets.kv.v2.iter_keys_from_path = self._iter_keys_from_path_v2
+        self.secrets.kv.v2.iter_changed_secrets_from_path = self._iter_changed_secrets_from_path_v2
         self.secrets.kv.v2.restore_secrets = self._restore_secrets_v2
+        self._kv_v2_create_or_update_secret = self.secrets.kv.v2.create_or_update_secret
+        self._kv_v2_delete_metadata_and_all_versions = self.secrets.kv.v2.delete_metadata_and_all_versions
+        self._kv_v2_delete_latest_version_of_secret = self.secrets.kv.v2.delete_latest_version_of_secret
+        self._kv_v2_delete_secret_versions = self.secrets.kv.v2.delete_secret_versions
+        self._kv_v2_destroy_secret_versions = self.secrets.kv.v2.destroy_secret_versions
+        self._kv_v2_read_secret_version = self.secrets.kv.v2.read_secret_version
+        self._kv_v2_list_secrets = self.secrets.kv.v2.list_secrets
+        self.secrets.kv.v2.create_or_update_secret = self._create_or_update_secret_v2
+        self.secrets.kv.v2.delete_metadata_and_all_versions = self._delete_metadata_and_all_versions_v2
+        self.secrets.kv.v2.delete_latest_version_of_secret = self._delete_latest_version_of_secret_v2
+        self.secrets.kv.v2.delete_secret_versions = self._delete_secret_versions_v2
+        self.secrets.kv.v2.destroy_secret_versions = self._destroy_secret_versions_v2
+        self.secrets.kv.v2.read_secret_version = self._read_secret_version_v2
+        self.secrets.kv.v2.list_secrets = self._list_secrets_v2
         self.max_workers = max_workers
+        self.keep_raw_token_data = keep_raw_token_data
+        self.token_cache = token_cache
+        self.listing_cache = listing_cache
+        self.secret_cache = secret_cache
+        self._single_flight = SingleFlight() if coalesce_reads else None
+        self.concurrency_limiter = concurrency_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        if kwargs.get('session') is None:
+            self._size_http_pool()
+        if concurrency_limiter is not None:
+            self._measure_http_requests()
+
+    def _size_http_pool(self):
+        """Keeps as many connections alive per host as there can be requests in flight so they are all reused."""
+        adapter = HTTPAdapter(pool_maxsize=self._pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _measure_http_requests(self):
+        """Reports every HTTP request sent to vault to the concurrency limiter.
+
+        Measuring at the transport means that reads served by the secret cache or joining a request in flight never
+        reach the limiter, so they cannot drag its baseline latency down.
+
+        """
+        for prefix in ('https://', 'http://'):
+            self.session.mount(prefix, MeasuredAdapter(self.session.get_adapter(prefix), self.concurrency_limiter))
+
+    @property
+    def _executor(self):
+        """The worker pool shared by all bulk operations, created on first use."""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._pool_size,
+                                                                   thread_name_prefix=LOGGER_BASENAME)
+            return self._pool
+
+    def close(self):
+        """Shuts down the shared worker pool, flushes persistent caches and closes the HTTP session of the client.
+
+        The worker pool is created anew if the client is used again afterwards.
+
+        """
+        with self._pool_lock:
+            executor, self._pool = self._pool, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for cache in (self.token_cache, self.listing_cache):
+            if hasattr(cache, 'flush'):
+                cache.flush()
+        self.adapter.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _coalesce(self, key, function):
+        if self._single_flight is None:
+            return function()
+        return self._single_flight.call(key, function)
+
+    def read(self, path, wrap_ttl=None):
+        """Reads a path, sharing the response among concurrent identical reads if coalesce_reads is set.
+
+        Args:
+            path: The path to read
+            wrap_ttl: The ttl of the response wrapping if any, wrapped reads are never shared
+
+        Returns:
+            dict: The response of vault if the path exists, None otherwise
+
+        """
+        if wrap_ttl is not None:
+            return super().read(path, wrap_ttl=wrap_ttl)
+        return self._coalesce(('read', str(path)), partial(super().read, path))
+
+    def list(self, path):
+        """Lists a path, sharing the response among concurrent identical listings if coalesce_reads is set.
+
+        Args:
+            path: The path to list
+
+        Returns:
+            dict: The response of vault if the path can be listed, None otherwise
+
+        """
+        return self._coalesce(('list', str(path)), partial(super().list, path))
+
+    def _list_secrets_v2(self, path, mount_point=DEFAULT_MOUNT_POINT):
+        return self._coalesce(('list_secrets', mount_point, str(path)),
+                              partial(self._kv_v2_list_secrets, path=path, mount_point=mount_point))
+
+    def _invalidate_listings(self, path):
+        if self.listing_cache is not None:
+            self.listing_cache.invalidate_listing(str(PurePosixPath(path)))
+
+    def _cached_listing(self, path, list_keys):
+        """Lists a directory through the listing cache if there is one.
+
+        Args:
+            path: The path of the directory as requested from vault, used as the cache key
+            list_keys: Callable returning the keys of the directory or None if it is not a directory
+
+        Returns:
+            list: The keys of the directory, None if it is not a directory
+
+        """
+        if self.listing_cache is None:
+            return list_keys()
+        path = str(PurePosixPath(path))
+        keys = self.listing_cache.get_listing(path)
+        if keys is None:
+            keys = list_keys()
+            if keys is not None:
+                self.listing_cache.set_listing(path, keys)
+        return keys
+
+    def write_data(self, path, *, data=None, wrap_ttl=None):
+        """Writes data to a path, invalidating the cached listings it affects.
+
+        Args:
+            path: The path to write to
+            data: The data to write
+            wrap_ttl: The ttl of the response wrapping if any
+
+        Returns:
+            The response of vault
+
+        """
+        response = super().write_data(path, data=data, wrap_ttl=wrap_ttl)
+        self._invalidate_listings(path)
+        return response
+
+    def delete(self, path):
+        """Deletes a path, invalidating the cached listings it affects.
+
+        Args:
+            path: The path to delete
+
+        """
+        super().delete(path)
+        self._invalidate_listings(path)
+
+    def _invalidate_secret_v2(self, path, mount_point):
+        self._invalidate_listings(PurePosixPath(mount_point, 'metadata', path))
+        if self.secret_cache is not None:
+            self.secret_cache.invalidate((mount_point, str(PurePosixPath(path))))
+
+    def _create_or_update_secret_v2(self, path, secret, cas=None, mount_point=DEFAULT_MOUNT_POINT):
+        try:
+            return self._kv_v2_create_or_update_secret(path=path, secret=secret, cas=cas, mount_point=mount_point)
+        finally:
+            self._invalidate_secret_v2(path, mount_point)
+
+    def _delete_metadata_and_all_versions_v2(self, path, mount_point=DEFAULT_MOUNT_POINT):
+        try:
+            return self._kv_v2_delete_metadata_and_all_versions(path=path, mount_point=mount_point)
+        finally:
+            self._invalidate_secret_v2(path, mount_point)
+
+    def _delete_latest_version_of_secret_v2(self, path, mount_point=DEFAULT_MOUNT_POINT):
+        try:
+            return self._kv_v2_delete_latest_version_of_secret(path=path, mount_point=mount_point)
+        finally:
+            self._invalidate_secret_v2(path, mount_point)
+
+    def _delete_secret_versions_v2(self, path, versions, mount_point=DEFAULT_MOUNT_POINT):
+        try:
+            return self._kv_v2_delete_secret_versions(path=path, versions=versions, mount_point=mount_point)
+        finally:
+            self._invalidate_secret_v2(path, mount_point)
+
+    def _destroy_secret_versions_v2(self, path, versions, mount_point=DEFAULT_MOUNT_POINT):
+        try:
+            return self._kv_v2_destroy_secret_versions(path=path, versions=versions, mount_point=mount_point)
+        finally:
+            self._invalidate_secret_v2(path, mount_point)
+
+    def _read_secret_version_v2(self, path, version=None, mount_point=DEFAULT_MOUNT_POINT,
+                                raise_on_deleted_version=None):
+        """Reads a kv v2 secret through the secret cache if there is one.
+
+        Only reads of the latest version are cached. A stale entry is revalidated against the current version in the
+        metadata of the secret if the cache is set to do so, and is read again if that version was deleted or destroyed
+        in the meantime.
+
+        Args:
+            path: The path of the secret
+            version: The version to read, the latest if not set
+            mount_point: Mountpoint for path
+            raise_on_deleted_version: Flag on whether to raise when the version read is deleted
+
+        Returns:
+            dict: A copy of the read response
+
+        """
+        read = partial(self._coalesce,
+                       ('read_secret_version', mount_point, str(path), version, raise_on_deleted_version),
+                       partial(self._kv_v2_read_secret_version,
+                               path=path,
+                               version=version,
+                               mount_point=mount_point,
+                               raise_on_deleted_version=raise_on_deleted_version))
+        cache = self.secret_cache
+        if cache is None or version is not None:
+            return read()
+        key = (mount_point, str(PurePosixPath(path)))
+        response, fresh = cache.get(key)
+        if response is not None and not fresh and cache.revalidate:
+            metadata = self.secrets.kv.v2.read_secret_metadata(path=path, mount_point=mount_point).get('data', {})
+            version = metadata.get('current_version')
+            current = metadata.get('versions', {}).get(str(version), {})
+            fresh = (version == response.get('data', {}).get('metadata', {}).get('version') and
+                     not current.get('deletion_time') and
+                     not current.get('destroyed'))
+            if fresh:
+                cache.refresh(key)
+        if response is None or not fresh:
+            response = read()
+            cache.set(key, response)
+        return deepcopy(response)
 
     def delete_path(self, path):
         """Deletes recursively a path from vault.
@@ -82,28 +395,159 @@ class Vault(Client):
 
         """
         try:
-            subdirs = self.list(path).get('data', {}).get('keys')
+            subdirs = self._call('list', partial(self.list, path)).get('data', {}).get('keys')
             for subdir in subdirs:
                 self.delete_path(PurePosixPath(path, subdir))
             self._logger.info('Deleting directory %s', path)
-            self.delete(path)
+            self._call('delete', partial(self.delete, path))
         except AttributeError:
             self._logger.info('Deleting secret %s', path)
-            self.delete(path)
+            self._call('delete', partial(self.delete, path))
 
     def _delete_path_v2(self, path, mount_point):
         """Deletes recursively a path from vault using v2 engine.
 
+        Secrets are found by listing only, their payloads are never read. Listing and deleting run concurrently,
+        keeping up to max_workers requests in flight.
+
         Args:
             path: The path to remove
             mount_point: Mountpoint for path
 
         """
-        secrets = self._retrieve_secrets_from_path_v2(path=path, mount_point=mount_point)
-        for secret in secrets:
-            self._logger.info('Deleting %s', secret)
-            self.secrets.kv.v2.delete_metadata_and_all_versions(path=secret.get('original_path', ''),
-                                                                mount_point=mount_point)
+        for _ in self._walk(path,
+                            partial(self._list_keys_v2, mount_point=mount_point),
+                            partial(self._delete_secret_v2, mount_point=mount_point)):
+            pass
+
+    @property
+    def _pool_size(self):
+        size = self.max_workers or DEFAULT_MAX_WORKERS
+        if self.concurrency_limiter is not None:
+            size = max(size, self.concurrency_limiter.maximum)
+        return size
+
+    @property
+    def _concurrency(self):
+        if self.concurrency_limiter is not None:
+            return self.concurrency_limiter.limit
+        return self.max_workers or DEFAULT_MAX_WORKERS
+
+    def _call(self, operation, function, retries=None):
+        """Makes a request of a bulk operation, retrying transient errors per the policy.
+
+        Args:
+            operation: The kind of the request, one of list, read, lookup, write, delete or revoke
+            function: Callable without arguments making the request, so that none of its arguments can clash with the
+                ones of this method
+            retries: The number of retries overriding the one of the retry policy for the operation
+
+        Returns:
+            The result of the callable
+
+        """
+        return self.retry_policy.call(operation, function, retries=retries)
+
+    def _walk(self, path, list_keys, handle_secret=None, checkpoint=None):  # pylint: disable=too-many-branches
+        """Walks a tree of secrets breadth first keeping a bounded number of requests in flight.
+
+        Keys ending with a slash are listed as directories, all other keys are handled as secrets. If the starting path
+        cannot be listed it is handled as a secret. Without a handle_secret callable only the keys are enumerated and
+        the paths of the secrets are yielded straight from the listings.
+
+        With a checkpoint the walk resumes from its saved state if there is one. A secret counts as completed once the
+        consumer asks for the next one after it, so the saved state never skips a secret the consumer has not dealt
+        with.
+
+        Args:
+            path: The path to start walking from
+            list_keys: Callable returning the keys under a path or None if the path is not a directory
+            handle_secret: Callable processing the secret stored under a path, returning None if there is none
+            checkpoint: Checkpoint to save the progress of the walk to and resume it from
+
+        Returns:
+            generator: Tuples of path and the result of handle_secret (or None) for every secret found under the path
+
+        """
+        progress = WalkProgress(checkpoint, path, list_keys, handle_secret)
+        frontier, ready = progress.resume()
+        in_flight = {}
+        try:
+            while True:
+                while ready:
+                    yield ready[0], None
+                    progress.complete(ready.popleft())
+                if not frontier and not in_flight:
+                    break
+                if progress.due:
+                    progress.save(list(frontier) + list(in_flight.values()), ready)
+                while frontier and len(in_flight) < self._concurrency:
+                    function, path_ = frontier.popleft()
+                    in_flight[self._executor.submit(function, path_)] = (function, path_)
+                for future in concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)[0]:
+                    function, path_ = in_flight[future]
+                    result = future.result()
+                    if function is list_keys:
+                        del in_flight[future]
+                        leaves, directories = split_listing(path_, result)
+                        frontier.extend((list_keys, directory) for directory in directories)
+                        progress.schedule(leaves, frontier, ready)
+                        continue
+                    if result is None:
+                        self._logger.warning('Secret %s disappeared before it could be processed', path_)
+                    else:
+                        yield path_, result
+                    del in_flight[future]
+                    progress.complete(path_)
+        except BaseException:
+            progress.save(list(frontier) + list(in_flight.values()), ready)
+            raise
+        finally:
+            for future in in_flight:
+                future.cancel()
+        progress.finish()
+
+    def _list_keys_v1(self, path):
+        def list_keys():
+            response = self._call('list', partial(self.list, path))
+            return response.get('data', {}).get('keys') if response else None
+        return self._cached_listing(path, list_keys)
+
+    def _read_secret_v1(self, path):
+        self._logger.info('Extracting secret %s', path)
+        return self._call('read', partial(self.read, path))
+
+    @staticmethod
+    def _as_checkpoint(checkpoint):
+        if checkpoint is None or isinstance(checkpoint, Checkpoint):
+            return checkpoint
+        return Checkpoint(checkpoint)
+
+    def iter_secrets_from_path(self, path, checkpoint=None):
+        """Iterates recursively over all the secrets from a path in vault.
+
+        Directories are listed and secrets are read concurrently, keeping up to max_workers requests in flight. Each
+        secret is yielded as soon as it is read.
+
+        With a checkpoint the pending directories and secrets and the completed secrets are saved periodically and
+        whenever the iteration stops early, so iterating again with the same checkpoint yields only the secrets that
+        were not yielded before. A secret is completed once the next one is asked for. The checkpoint file is removed
+        when the iteration completes.
+
+        Args:
+            path: The path to retrieve all the secrets for
+            checkpoint: A Checkpoint or the path of the checkpoint file to resume from and save progress to
+
+        Returns:
+            generator: The secret dictionaries with the "original_path" attribute set
+
+        """
+        for original_path, secret in self._walk(path,
+                                                self._list_keys_v1,
+                                                self._read_secret_v1,
+                                                self._as_checkpoint(checkpoint)):
+            secret['original_path'] = original_path
+            yield secret
 
     def retrieve_secrets_from_path(self, path):
         """Retrieves recursively all the secrets from a path in vault.
@@ -111,24 +555,137 @@ class Vault(Client):
         Args:
             path: The path to retrieve all the secrets for
 
+        Returns:
+            list: The secret dictionaries with the "original_path" attribute set
+
         """
-        secrets = []
+        return list(self.iter_secrets_from_path(path))
 
-        def recurse(vault, path):
-            """Recurses through a path."""
+    def _list_keys_v2(self, path, mount_point):
+        def list_keys():
             try:
-                subdirs = vault.list(path).get('data', {}).get('keys')
-                for subdir in subdirs:
-                    recurse(vault, PurePosixPath(path, subdir))
-                vault._logger.info('Reached directory %s', path)  # pylint: disable=protected-access
-            except AttributeError:
-                vault._logger.info('Extracting secret %s', path)  # pylint: disable=protected-access
-                secret = vault.read(path)
-                secret['original_path'] = path
-                secrets.append(secret)
-
-        recurse(self, path)
-        return secrets
+                response = self._call('list',
+                                      partial(self.secrets.kv.v2.list_secrets, path=path, mount_point=mount_point))
+                return response.get('data', {}).get('keys')
+            except InvalidPath:
+                return None
+        return self._cached_listing(PurePosixPath(mount_point, 'metadata', path), list_keys)
+
+    def _read_secret_v2(self, path, mount_point):
+        self._logger.info('Extracting secret %s', path)
+        try:
+            return self._call('read',
+                              partial(self.secrets.kv.v2.read_secret_version, path=path, mount_point=mount_point))
+        except InvalidPath:
+            return None
+
+    def _delete_secret_v2(self, path, mount_point):
+        self._logger.info('Deleting %s', path)
+        self._call('delete',
+                   partial(self.secrets.kv.v2.delete_metadata_and_all_versions, path=path, mount_point=mount_point))
+        return path
+
+    def _iter_keys_from_path_v2(self, path, mount_point, checkpoint=None):
+        """Iterates recursively over the paths of all the secrets under a path in vault using v2 engine.
+
+        Only list calls are made, the secrets themselves are not read.
+
+        Args:
+            path: The path to enumerate the secrets for
+            mount_point: Mountpoint for path
+            checkpoint: A Checkpoint or the path of the checkpoint file to resume from and save progress to
+
+        Returns:
+            generator: The paths of the secrets
+
+        """
+        for secret_path, _ in self._walk(path,
+                                         partial(self._list_keys_v2, mount_point=mount_point),
+                                         checkpoint=self._as_checkpoint(checkpoint)):
+            yield secret_path
+
+    def _iter_secrets_from_path_v2(self, path, mount_point, checkpoint=None):
+        """Iterates recursively over all the secrets from a path in vault using v2 engine.
+
+        Directories are listed and secrets are read concurrently, keeping up to max_workers requests in flight. Each
+        secret is yielded as soon as it is read. A checkpoint makes the iteration resumable as with
+        iter_secrets_from_path.
+
+        Args:
+            path: The path to retrieve all the secrets for
+            mount_point: Mountpoint for path
+            checkpoint: A Checkpoint or the path of the checkpoint file to resume from and save progress to
+
+        Returns:
+            generator: The secret dictionaries with the "original_path" attribute set
+
+        """
+        for original_path, secret in self._walk(path,
+                                                partial(self._list_keys_v2, mount_point=mount_point),
+                                                partial(self._read_secret_v2, mount_point=mount_point),
+                                                self._as_checkpoint(checkpoint)):
+            secret['original_path'] = original_path
+            yield secret
+
+    def _read_changed_secret_v2(self, path, mount_point, manifest):
+        try:
+            metadata = self._call('read',
+                                  partial(self.secrets.kv.v2.read_secret_metadata, path=path, mount_point=mount_point))
+        except InvalidPath:
+            return None
+        version = metadata.get('data', {}).get('current_version')
+        updated_time = metadata.get('data', {}).get('updated_time')
+        current = metadata.get('data', {}).get('versions', {}).get(str(version), {})
+        if current.get('deletion_time') or current.get('destroyed'):
+            return version, updated_time, _DELETED
+        if manifest.is_current(path, version, updated_time):
+            return version, updated_time, None
+        self._logger.info('Extracting changed secret %s', path)
+        try:
+            secret = self._call('read',
+                                partial(self.secrets.kv.v2.read_secret_version,
+                                        path=path,
+                                        version=version,
+                                        mount_point=mount_point))
+        except InvalidPath:
+            return None
+        return version, updated_time, secret
+
+    def _iter_changed_secrets_from_path_v2(self, path, mount_point, manifest):
+        """Iterates recursively over the secrets from a path in vault using v2 engine that changed since a backup.
+
+        Only the metadata of every secret is read, the secrets themselves are read only if their current version or
+        update time differ from the ones in the manifest. Secrets in the manifest that are gone or whose current
+        version is deleted or destroyed are yielded as tombstones after all other secrets. The manifest is updated
+        with every secret as it is yielded, so it can be saved along with the backup for the next one.
+
+        Args:
+            path: The path to retrieve the changed secrets for
+            mount_point: Mountpoint for path
+            manifest: The BackupManifest of the previous backup, an empty one for a full backup
+
+        Returns:
+            generator: The changed secret dictionaries with the "original_path" attribute set and the tombstones
+                with the "original_path" and "deleted" attributes set
+
+        """
+        seen = set()
+        for original_path, (version, updated_time, secret) in self._walk(
+                path,
+                partial(self._list_keys_v2, mount_point=mount_point),
+                partial(self._read_changed_secret_v2, mount_point=mount_point, manifest=manifest)):
+            if secret is _DELETED:
+                continue
+            seen.add(str(original_path))
+            if secret is not None:
+                secret['original_path'] = original_path
+                yield secret
+            manifest.update(original_path, version, updated_time)
+        for deleted_path in manifest.paths(path):
+            if deleted_path not in seen:
+                self._logger.info('Recording deletion of secret %s', deleted_path)
+                yield {'original_path': deleted_path, TOMBSTONE_ATTRIBUTE: True}
+                manifest.remove(deleted_path)
 
     def _retrieve_secrets_from_path_v2(self, path, mount_point):
         """Retrieves recursively all the secrets from a path in vault using v2 engine.
@@ -137,141 +694,882 @@ class Vault(Client):
             path: The path to retrieve all the secrets for
             mount_point: Mountpoint for path
 
-        """
-        secrets = []
+        Returns:
+            list: The secret dictionaries with the "original_path" attribute set
 
-        def recurse(vault, path):
-            """Recurses through a path."""
-            try:
-                subdirs = vault.secrets.kv.v2.list_secrets(path=path,
-                                                           mount_point=mount_point).get('data', {}).get('keys')
-                for subdir in subdirs:
-                    recurse(vault, PurePosixPath(path, subdir))
-                vault._logger.info('Reached directory %s', path)  # pylint: disable=protected-access
-            except InvalidPath:
-                vault._logger.info('Extracting secret %s', path)  # pylint: disable=protected-access
-                secret = vault.secrets.kv.v2.read_secret_version(path=path,
-                                                                 mount_point=mount_point)
-                secret['original_path'] = path
-                secrets.append(secret)
+        """
+        return list(self._iter_secrets_from_path_v2(path, mount_point))
 
-        recurse(self, path)
-        return secrets
+    def _run_bounded(self, function, items, rate_limit=None):
+        """Runs a function over items concurrently keeping a bounded number of calls in flight.
 
-    def restore_secrets(self, secrets):
-        """Restores secrets to vault in their original path.
+        Items are only pulled from the iterable when there is room in the window so it can be a lazy generator.
 
         Args:
-            secrets: List of secret dictionaries with "original_path" attribute set
+            function: Callable accepting a single item
+            items: Iterable of items to call the function with
+            rate_limit: Maximum number of calls to start per second, unlimited if not set
 
         Returns:
-            True on success, False otherwise
+            generator: Tuples of item and the completed future of its call, in completion order
 
         """
-        if not isinstance(secrets, (list, tuple)):
-            self._logger.error('Please provide a list or tuple of secrets to restore.')
+        items = iter(items)
+        limiter = RateLimiter(rate_limit) if rate_limit else None
+        in_flight = {}
+        executor = self._executor
+        try:
+            while True:
+                for item in islice(items, max(0, self._concurrency - len(in_flight))):
+                    if limiter:
+                        limiter.wait()
+                    in_flight[executor.submit(function, item)] = item
+                if not in_flight:
+                    break
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def _restore(self, secrets, write_secret, rate_limit):
+        if not RestoreReport.accepts(secrets):
+            self._logger.error('Please provide an iterable of secrets to restore.')
             return False
-        for secret in secrets:
-            path = secret.get('original_path')
-            if not path:
-                self._logger.error('No "original_path" found, cannot restore.')
-                continue
-            data = secret.get('data')
-            self._logger.info('Adding secrets to path %s', path)
-            self.write(path, **data)
-        return True
+        report = RestoreReport()
+        for secret, future in self._run_bounded(write_secret, report.restorable(secrets), rate_limit):
+            report.record(secret, future)
+        return report
+
+    def _write_secret_v1(self, secret):
+        path = secret.get('original_path')
+        self._logger.info('Adding secrets to path %s', path)
+        self._call('write', partial(self.write_data, path, data=secret.get('data')))
+
+    def restore_secrets(self, secrets, rate_limit=None):
+        """Restores secrets to vault in their original path.
+
+        Secrets are written concurrently, keeping up to max_workers requests in flight. Tombstones of differential
+        backups are skipped.
+
+        Args:
+            secrets: Iterable of secret dictionaries with "original_path" attribute set, consumed lazily so that it can
+                be a generator like the one of import_secrets
+            rate_limit: Maximum number of writes to start per second, unlimited if not set
+
+        Returns:
+            RestoreReport: The restored and failed secrets, evaluating to True if all succeeded, False on invalid input
 
-    def _restore_secrets_v2(self, secrets, mount_point):
+        """
+        return self._restore(secrets, self._write_secret_v1, rate_limit)
+
+    def _write_secret_v2(self, secret, mount_point):
+        path = secret.get('original_path')
+        self._logger.info('Adding secrets to path %s', path)
+        self._call('write',
+                   partial(self.secrets.kv.v2.create_or_update_secret,
+                           mount_point=mount_point,
+                           path=path,
+                           secret=secret.get('data', {}).get('data')))
+
+    def _restore_secrets_v2(self, secrets, mount_point, rate_limit=None):
         """Restores secrets to vault in their original path using v2 engine.
 
+        Secrets are written concurrently, keeping up to max_workers requests in flight. Tombstones of differential
+        backups are skipped.
+
         Args:
-            secrets: List of secret dictionaries with "original_path" attribute set
+            secrets: Iterable of secret dictionaries with "original_path" attribute set, consumed lazily so that it can
+                be a generator like the one of import_secrets
             mount_point: Mountpoint for path
+            rate_limit: Maximum number of writes to start per second, unlimited if not set
 
         Returns:
-            True on success, False otherwise
+            RestoreReport: The restored and failed secrets, evaluating to True if all succeeded, False on invalid input
 
         """
-        if not isinstance(secrets, (list, tuple)):
-            self._logger.error('Please provide a list or tuple of secrets to restore.')
-            return False
-        for secret in secrets:
-            path = secret.get('original_path')
-            if not path:
-                self._logger.error('No "original_path" found, cannot restore.')
-                continue
-            data = secret.get('data', {}).get('data')
-            self._logger.info('Adding secrets to path %s', path)
-            self.secrets.kv.v2.create_or_update_secret(mount_point=mount_point,
-                                                       path=path,
-                                                       secret=data)
-        return True
+        return self._restore(secrets, partial(self._write_secret_v2, mount_point=mount_point), rate_limit)
 
     @property
     def _token_accessors(self):
+        try:
+            response = self._call('list', self._get_token_accessors)
+        except TRANSIENT_ERRORS:
+            response = None
+        if response is None:
+            self._logger.error('Error retrieving accessors.')
+            return None
+        return response.get('data', {}).get('keys', [])
+
+    def _get_token_accessors(self):
         headers = {'X-Vault-Token': self.token}
         url = '{host}/v1/auth/token/accessors?vaultaddr={host}&list=true'.format(host=self.url)
         response = self.session.get(url, headers=headers)
-        if not response.ok:
-            self._logger.error('Error retrieving accessors.')
-        return response.json().get('data', {}).get('keys', []) if response.ok else None
+        try:
+            if response.status_code == 429 or response.status_code >= 500:
+                raise_for_error('GET', url, response.status_code, text=response.text)
+            return response.json() if response.ok else None
+        finally:
+            response.close()
+
+    def _lookup_accessor(self, accessor):
+        return self._coalesce(('lookup-accessor', accessor), partial(self._post_lookup_accessor, accessor))
+
+    def _post_lookup_accessor(self, accessor):
+        headers = {'X-Vault-Token': self.token}
+        url = '{host}/v1/auth/token/lookup-accessor?vaultaddr={host}'.format(host=self.url)
+        response = self.session.post(url, headers=headers, data=json.dumps({"accessor": accessor}))
+        try:
+            if response.status_code == 429 or response.status_code >= 500:
+                raise_for_error('POST', url, response.status_code, text=response.text)
+            return response.json()
+        finally:
+            response.close()
 
     @property
     def tokens(self):
         """Models the tokens of a vault installation.
 
+        Lookups run concurrently keeping up to max_workers requests in flight, so only a bounded window of responses
+        is held in memory no matter how many tokens exist.
+
         Returns:
-            list:All tokens of a vault in a Token object format
+            generator: All tokens of a vault in a Token object format
 
         """
-        headers = {'X-Vault-Token': self.token}
-        url = '{host}/v1/auth/token/lookup-accessor?vaultaddr={host}'.format(host=self.url)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = [executor.submit(self.session.post,
-                                       url,
-                                       headers=headers,
-                                       data=json.dumps({"accessor": accessor}))
-                       for accessor in self._token_accessors]
-            for future in concurrent.futures.as_completed(futures):
+        return self.filter_tokens()
+
+    def filter_tokens(self,  # pylint: disable=too-many-arguments
+                      predicate=None,
+                      policies=None,
+                      display_name_prefix=None,
+                      limit=None,
+                      skip_accessors=None):
+        """Retrieves the tokens of a vault installation that match the provided criteria.
+
+        Accessors in skip_accessors are never looked up and lookups stop as soon as limit tokens have matched. Broken
+        tokens only match when no criteria are provided.
+
+        Args:
+            predicate: Callable accepting a Token and returning whether it matches
+            policies: Iterable of policies, a token matches if it has any of them
+            display_name_prefix: The prefix the display name of a token should start with
+            limit: The maximum number of tokens to retrieve
+            skip_accessors: Container of accessors known to be of no interest
+
+        Returns:
+            generator: The matching tokens in a Token object format
+
+        """
+        criteria = []
+        if policies:
+            policies = set(policies)
+            criteria.append(lambda token: not policies.isdisjoint(token.policies))
+        if display_name_prefix:
+            criteria.append(lambda token: token.display_name.startswith(display_name_prefix))
+        if predicate:
+            criteria.append(predicate)
+        accessors = self._token_accessors
+        if accessors is None:
+            accessors = []
+        elif self.token_cache is not None:
+            self.token_cache.retain(accessors)
+        if skip_accessors:
+            accessors = (accessor for accessor in accessors if accessor not in skip_accessors)
+        responses = self._lookup_responses(accessors)
+        matches = 0
+        try:
+            for response in responses:
+                try:
+                    token = TokenFactory(self, response)
+                except Exception:  # pylint: disable=broad-except
+                    self._logger.exception('Future failed...')
+                    continue
+                if criteria and (isinstance(token, BrokenToken) or not all(match(token) for match in criteria)):
+                    continue
+                yield token
+                matches += 1
+                if limit and matches >= limit:
+                    return
+        finally:
+            responses.close()
+
+    def _lookup_responses(self, accessors):
+        """Looks up accessors, serving the fresh ones from the token cache if there is one.
+
+        Args:
+            accessors: Iterable of accessors
+
+        Returns:
+            generator: The lookup responses, cached ones first
+
+        """
+        cache = self.token_cache
+        if cache is not None:
+            misses = []
+            for accessor in accessors:
+                response = cache.get(accessor)
+                if response is None:
+                    misses.append(accessor)
+                else:
+                    yield response
+            accessors = misses
+
+        def lookup(accessor):
+            return self._call('lookup', partial(self._lookup_accessor, accessor))
+
+        lookups = self._run_bounded(lookup, accessors)
+        try:
+            for accessor, future in lookups:
                 try:
                     response = future.result()
-                    response_data = response.json()
-                    response.close()
-                    yield TokenFactory(self, response_data)
                 except Exception:  # pylint: disable=broad-except
                     self._logger.exception('Future failed...')
+                    continue
+                if cache is not None and 'errors' not in response:
+                    cache.set(accessor, response)
+                yield response
+        finally:
+            lookups.close()
+
+    def revoke_token(self, token, orphan=False, accessor=False):
+        """Revokes a token, dropping it from the token cache when revoked by accessor.
+
+        Args:
+            token: The token or accessor to revoke
+            orphan: Flag on whether to revoke the token leaving its children orphan
+            accessor: Flag on whether the token provided is an accessor
+
+        """
+        super().revoke_token(token, orphan=orphan, accessor=accessor)
+        if accessor and self.token_cache is not None:
+            self.token_cache.discard(token)
+
+    def _revoke_accessor(self, accessor, retries):
+        if not accessor:
+            return False
+        self._logger.info('Revoking token with accessor %s', accessor)
+        self._call('revoke', partial(self.revoke_token, accessor, accessor=True), retries=retries)
+        return True
+
+    def _revoke_matching_accessor(self, accessor, predicate, retries):
+        response = self._call('lookup', partial(self._lookup_accessor, accessor), retries=retries)
+        errors = response.get('errors')
+        if errors:
+            gone = any(INVALID_ACCESSOR_ERROR in str(error).lower() for error in errors)
+        else:
+            gone = not response.get('data')
+        if gone:
+            self._logger.info('Skipping token with accessor %s that no longer exists', accessor)
+            return False
+        if errors:
+            raise ValueError('Lookup failed with errors {}'.format(response['errors']))
+        return self._revoke_accessor(accessor, retries) if predicate(TokenFactory(self, response)) else False
+
+    def revoke_tokens(self, predicate_or_iterable, retries=None):
+        """Revokes tokens in bulk.
+
+        With a predicate every token is looked up and revoked if the predicate holds for it, lookups and revocations
+        overlapping on the shared worker pool. Tokens that expired or were revoked since their accessors were listed
+        are skipped. With an iterable the tokens or accessors in it are revoked directly.
+        Up to max_workers requests are kept in flight and transient errors are retried, revocations only when vault
+        surely did not process them.
+
+        Args:
+            predicate_or_iterable: Callable accepting a Token and returning whether to revoke it, or an iterable of
+                Token objects or accessors
+            retries: The number of times to retry a request failing with a transient error, defaults to the retry
+                policy of the client
+
+        Returns:
+            RevocationReport: The revoked, skipped and failed accessors, evaluating to True if none failed. If the
+                accessors cannot be listed the failure is recorded with None as the accessor
+
+        """
+        report = RevocationReport()
+        if callable(predicate_or_iterable):
+            task = partial(self._revoke_matching_accessor, predicate=predicate_or_iterable, retries=retries)
+            accessors = self._token_accessors
+            if accessors is None:
+                report.failed.append((None, RuntimeError('Could not list the token accessors')))
+                return report
+        else:
+            task = partial(self._revoke_accessor, retries=retries)
+            accessors = (getattr(item, 'accessor', item) for item in predicate_or_iterable)
+        for accessor, future in self._run_bounded(task, accessors):
+            try:
+                (report.revoked if future.result() else report.skipped).append(accessor)
+            except Exception as error:  # pylint: disable=broad-except
+                self._logger.error('Failed to revoke token with accessor %s: %s', accessor, error)
+                report.failed.append((accessor, error))
+        return report
+
+    @property
+    def token_inventory(self):
+        """A column oriented snapshot of the tokens of the vault installation.
+
+        Returns:
+            TokenInventory: The inventory of all valid tokens
+
+        """
+        return TokenInventory.from_tokens(self.tokens)
+
+
+@lru_cache(maxsize=None)
+def _utc_offset(sign, hours, minutes):
+    offset = timedelta(hours=int(hours), minutes=int(minutes))
+    return timezone(-offset if sign == '-' else offset)
+
+
+def parse_time(value):
+    """Parses a time as reported by vault.
+
+    RFC 3339 times are parsed directly, fractions beyond microseconds are truncated. Anything else falls back to the
+    generic dateutil parser.
+
+    Args:
+        value: The string to parse
+
+    Returns:
+        datetime: The parsed time
+
+    Raises:
+        ValueError: If the value cannot be parsed
+        TypeError: If the value is not a string
+
+    """
+    match = RFC3339_PATTERN.match(value)
+    if not match:
+        return parse(value)
+    year, month, day, hour, minute, second, fraction, zulu, sign, offset_hours, offset_minutes = match.groups()
+    tzinfo = timezone.utc if zulu else _utc_offset(sign, offset_hours, offset_minutes)
+    microsecond = int(fraction[:6].ljust(6, '0')) if fraction else 0
+    return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), microsecond, tzinfo)
+
+
+def split_listing(path, keys):
+    """Splits the keys listed under a path into the paths of its secrets and of its directories.
+
+    Args:
+        path: The listed path
+        keys: The keys listed under the path, None if the path is not a directory and so is a secret itself
+
+    Returns:
+        tuple: The list of the paths of the secrets and the list of the paths of the directories
+
+    """
+    if keys is None:
+        return [path], []
+    LOGGER.info('Reached directory %s', path)
+    return ([PurePosixPath(path, key) for key in keys if not key.endswith('/')],
+            [PurePosixPath(path, key) for key in keys if key.endswith('/')])
+
+
+class RestoreReport:
+    """Models the outcome of restoring secrets to vault."""
+
+    def __init__(self):
+        logger_name = u'{base}.{suffix}'.format(base=LOGGER_BASENAME,
+                                                suffix=self.__class__.__name__)
+        self._logger = logging.getLogger(logger_name)
+        self.restored = []
+        self.failed = []
+
+    @staticmethod
+    def accepts(secrets):
+        """Tells whether secrets are provided as an iterable of secret dictionaries that can be restored.
+
+        Args:
+            secrets: The secrets to restore
+
+        Returns:
+            bool: True if the secrets are an iterable other than a string or a single dictionary, False otherwise
+
+        """
+        return not isinstance(secrets, (str, bytes, dict)) and hasattr(secrets, '__iter__')
+
+    def restorable(self, secrets):
+        """Filters the secrets that can be restored, recording the ones without an original path as failed.
+
+        Tombstones of differential backups are skipped.
+
+        Args:
+            secrets: Iterable of secret dictionaries
+
+        Returns:
+            generator: The secret dictionaries with the "original_path" attribute set
+
+        """
+        for secret in secrets:
+            if not secret.get('original_path'):
+                self._logger.error('No "original_path" found, cannot restore.')
+                self.failed.append((None, ValueError('No "original_path" found')))
+                continue
+            if secret.get(TOMBSTONE_ATTRIBUTE):
+                self._logger.info('Skipping tombstone of deleted secret %s', secret.get('original_path'))
+                continue
+            yield secret
+
+    def record(self, secret, outcome):
+        """Records the outcome of writing a secret.
+
+        Args:
+            secret: The secret dictionary with the "original_path" attribute set
+            outcome: The completed future or task of the write
+
+        """
+        path = secret.get('original_path')
+        try:
+            outcome.result()
+            self.restored.append(path)
+        except Exception as error:  # pylint: disable=broad-except
+            self._logger.error('Failed to restore secret %s: %s', path, error)
+            self.failed.append((path, error))
+
+    def __bool__(self):
+        return not self.failed
+
+    def __repr__(self):
+        return '<{name} restored={restored} failed={failed}>'.format(name=self.__class__.__name__,
+                                                                     restored=len(self.restored),
+                                                                     failed=len(self.failed))
+
+
+class RevocationReport:
+    """Models the outcome of revoking tokens in bulk."""
+
+    def __init__(self):
+        self.revoked = []
+        self.skipped = []
+        self.failed = []
+
+    def __bool__(self):
+        return not self.failed
+
+    def __repr__(self):
+        return '<{name} revoked={revoked} skipped={skipped} failed={failed}>'.format(name=self.__class__.__name__,
+                                                                                     revoked=len(self.revoked),
+                                                                                     skipped=len(self.skipped),
+                                                                                     failed=len(self.failed))
+
+
+class SingleFlight:  # pylint: disable=too-few-public-methods
+    """Shares the outcome of a call among all callers asking for the same key while that call is in flight.
+
+    The result is copied once before it is shared. The caller that starts the call keeps the result as is and callers
+    joining it get their own deep copy of that snapshot, so that none of them can affect what the others see.
+
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, function):
+        """Calls the function unless a call for the same key is already in flight, in which case it waits for that.
+
+        Args:
+            key: The hashable key identifying identical calls
+            function: Callable without arguments doing the call
+
+        Returns:
+            The result of the call
+
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = concurrent.futures.Future()
+        if not leader:
+            return deepcopy(future.result())
+        try:
+            result = function()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(deepcopy(result))
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class RetryPolicy:  # pylint: disable=too-many-instance-attributes
+    """Retries requests failing with transient errors with exponential backoff and full jitter.
+
+    Requests of idempotent operations (list, read, lookup and delete) are retried after any transient error. Requests
+    of other operations (write and revoke) are only retried after errors for which vault surely did not process them,
+    like 429, 503 or a connection that could not be established, so that a write is never applied twice.
+
+    Every operation has a retry budget so that a struggling vault is not flooded with retries. It starts full, every
+    request adds the budget ratio to it, up to its size, and every retry takes one from it. Without budget left errors
+    are raised at once.
+
+    The same policy can be shared by a Vault and an AsyncVault, the latter retrying through call_async.
+
+    Args:
+        retries: The number of retries of a request, or a dictionary of operation to its number of retries with
+            the "default" key applying to the rest
+        backoff: The seconds to wait at most before the first retry, doubling on every next one
+        max_backoff: The seconds to wait at most before any retry
+        budget: The size of the retry budget of every operation
+        budget_ratio: The fraction of a retry every request adds to the budget of its operation
+
+    """
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 retries=3,
+                 backoff=RETRY_BACKOFF,
+                 max_backoff=30.0,
+                 budget=100,
+                 budget_ratio=0.2):
+        logger_name = u'{base}.{suffix}'.format(base=LOGGER_BASENAME,
+                                                suffix=self.__class__.__name__)
+        self._logger = logging.getLogger(logger_name)
+        self.retries = retries if isinstance(retries, dict) else {'default': retries}
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.budget_ratio = budget_ratio
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    @property
+    def budgets(self):
+        """The retries left in the budget of every operation that made a request."""
+        with self._lock:
+            return dict(self._budgets)
+
+    def _deposit(self, operation):
+        with self._lock:
+            self._budgets[operation] = min(self.budget,
+                                           self._budgets.get(operation, self.budget) + self.budget_ratio)
+
+    def _withdraw(self, operation):
+        with self._lock:
+            if self._budgets.get(operation, self.budget) < 1:
+                return False
+            self._budgets[operation] -= 1
+            return True
+
+    @staticmethod
+    def is_retryable(operation, error):
+        """Tells whether a request of an operation that failed with an error can be repeated.
+
+        Args:
+            operation: The kind of the request
+            error: The exception the request failed with
+
+        Returns:
+            bool: True if the error is transient and repeating the request is safe, False otherwise
+
+        """
+        if operation in IDEMPOTENT_OPERATIONS:
+            return isinstance(error, TRANSIENT_ERRORS)
+        return isinstance(error, UNPROCESSED_ERRORS)
+
+    def _start(self, operation, retries):
+        """Counts a request in the budget of its operation, returning the number of retries it is allowed."""
+        self._deposit(operation)
+        if retries is None:
+            return self.retries.get(operation, self.retries.get('default', 0))
+        return retries
+
+    def _delay(self, operation, attempt, retries, error):
+        """Returns the seconds to wait before repeating a failed attempt, None if it must not be repeated."""
+        if attempt == retries or not self.is_retryable(operation, error):
+            return None
+        if not self._withdraw(operation):
+            self._logger.warning('Retry budget of %s requests is exhausted, not retrying', operation)
+            return None
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        self._logger.warning('Retrying %s request in %.2fs after transient error: %s', operation, delay, error)
+        return delay
+
+    def call(self, operation, function, retries=None):
+        """Calls a function making a request, retrying it as the policy allows.
+
+        Args:
+            operation: The kind of the request, one of list, read, lookup, write, delete or revoke
+            function: Callable without arguments making the request
+            retries: The number of retries overriding the one of the policy for the operation
+
+        Returns:
+            The result of the callable
+
+        """
+        retries = self._start(operation, retries)
+        for attempt in range(retries + 1):
+            try:
+                return function()
+            except Exception as error:  # pylint: disable=broad-except
+                delay = self._delay(operation, attempt, retries, error)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+        return None
+
+    async def call_async(self, operation, function, retries=None):
+        """Awaits a coroutine function making a request, retrying it as the policy allows without blocking the loop.
+
+        Args:
+            operation: The kind of the request, one of list, read, lookup, write, delete or revoke
+            function: Coroutine function without arguments making the request
+            retries: The number of retries overriding the one of the policy for the operation
+
+        Returns:
+            The result of the coroutine
+
+        """
+        retries = self._start(operation, retries)
+        for attempt in range(retries + 1):
+            try:
+                return await function()
+            except Exception as error:  # pylint: disable=broad-except
+                delay = self._delay(operation, attempt, retries, error)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+        return None
+
+
+class ConcurrencyLimiter:  # pylint: disable=too-many-instance-attributes
+    """Adapts the number of requests kept in flight by additive increase and multiplicative decrease.
+
+    The limit grows by one for every full window of successful requests and is cut by the backoff factor when vault
+    answers with 429 or 5xx, when a request times out, or when the recent latency of an operation rises above its
+    baseline latency by the tolerance factor. Every operation, the HTTP method of the request with listings apart,
+    keeps its own latencies so that fast listings do not make reads look slow. The baseline is the lowest latency seen
+    in the last baseline window seconds, so it stays close to the latency of an unloaded vault and still recovers when
+    vault gets slower for good. The limit is cut at most once per window so that the requests already in flight when
+    vault got overloaded do not collapse it. A single limiter can be shared by several clients talking to the same
+    vault.
+
+    """
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 maximum=DEFAULT_MAX_WORKERS,
+                 minimum=1,
+                 initial=None,
+                 backoff=0.5,
+                 tolerance=2.0,
+                 baseline_window=BASELINE_WINDOW):
+        logger_name = u'{base}.{suffix}'.format(base=LOGGER_BASENAME,
+                                                suffix=self.__class__.__name__)
+        self._logger = logging.getLogger(logger_name)
+        if not 1 <= minimum <= maximum:
+            raise ValueError('Expected 1 <= minimum <= maximum, got minimum {} and maximum {}'.format(minimum, maximum))
+        self.maximum = maximum
+        self.minimum = minimum
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.baseline_window = baseline_window
+        self._limit = float(min(maximum, max(minimum, initial or maximum // 2)))
+        self._latencies = {}
+        self._since_decrease = 0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        """The number of requests that can currently be kept in flight."""
+        return int(self._limit)
+
+    @property
+    def latencies(self):
+        """The recent and the baseline latency in seconds of every operation that succeeded so far."""
+        with self._lock:
+            return {operation: (recent, lowest[0][1])
+                    for operation, (recent, lowest) in self._latencies.items()}
+
+    def __repr__(self):
+        return '<{name} limit={limit} minimum={minimum} maximum={maximum}>'.format(name=self.__class__.__name__,
+                                                                                   limit=self.limit,
+                                                                                   minimum=self.minimum,
+                                                                                   maximum=self.maximum)
+
+    def record(self, operation, latency, overloaded=False):
+        """Records the outcome of a request, adapting the limit.
+
+        Args:
+            operation: The kind of the request, latencies are only compared among requests of the same kind
+            latency: The seconds the request took
+            overloaded: Whether vault answered that it is overloaded
+
+        """
+        with self._lock:
+            self._since_decrease += 1
+            if overloaded:
+                self._decrease('vault is overloaded')
+                return
+            recent, baseline = self._update_latency(operation, latency)
+            if recent > self.tolerance * max(baseline, MINIMUM_BASELINE_LATENCY):
+                self._decrease('{} latency rose to {:.3f}s from {:.3f}s'.format(operation, recent, baseline))
+            else:
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+
+    def _update_latency(self, operation, latency):
+        """Folds a latency in the recent average and the windowed minimum of the operation, returning both.
+
+        The candidates for the minimum are kept in a deque of increasing latencies, so the oldest entry is always the
+        lowest latency of the window.
+
+        """
+        now = time.monotonic()
+        recent, lowest = self._latencies.get(operation, (latency, deque()))
+        recent += 0.2 * (latency - recent)
+        while lowest and lowest[-1][1] >= latency:
+            lowest.pop()
+        lowest.append((now, latency))
+        while lowest[0][0] < now - self.baseline_window:
+            lowest.popleft()
+        self._latencies[operation] = recent, lowest
+        return recent, lowest[0][1]
+
+    def _decrease(self, reason):
+        if self._since_decrease < self._limit:
+            return
+        self._since_decrease = 0
+        self._limit = max(self.minimum, self._limit * self.backoff)
+        self._logger.info('Lowered concurrency to %s since %s', self.limit, reason)
+
+
+class MeasuredAdapter(BaseAdapter):
+    """Wraps a transport adapter of requests, reporting the latency and overload of every request to a limiter."""
+
+    def __init__(self, adapter, limiter):
+        super().__init__()
+        self.adapter = adapter
+        self.limiter = limiter
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        """Sends a request through the wrapped adapter, recording how it went.
+
+        Args:
+            request: The prepared request to send
+            **kwargs: The arguments of the wrapped adapter, like timeout, verify and proxies
+
+        Returns:
+            The response of the wrapped adapter
+
+        """
+        operation = 'LIST' if request.method == 'LIST' or 'list=true' in request.url.lower() else request.method
+        start = time.monotonic()
+        try:
+            response = self.adapter.send(request, **kwargs)
+        except Timeout:
+            self.limiter.record(operation, time.monotonic() - start, overloaded=True)
+            raise
+        self.limiter.record(operation,
+                            time.monotonic() - start,
+                            overloaded=response.status_code in OVERLOAD_STATUS_CODES)
+        return response
+
+    def close(self):
+        """Closes the wrapped adapter."""
+        self.adapter.close()
+
+
+class RateLimiter:
+    """Spaces out calls so that no more than rate calls start per second, shared safely across threads."""
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reserves the next available slot.
+
+        Returns:
+            float: The seconds to wait before the slot starts
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self._interval
+        return slot - now
+
+    def wait(self):
+        """Blocks until the next slot is available."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
 
 
 class TokenFactory:  # pylint: disable=too-few-public-methods
     """Factory to create the appropriate Token type."""
 
     def __new__(cls, vault_instance, data):
+        keep_raw_data = getattr(vault_instance, 'keep_raw_token_data', False)
         try:
             if 'errors' in data.keys():
-                token = BrokenToken(vault_instance, data)
+                token = BrokenToken(vault_instance, data, keep_raw_data)
             else:
-                token = Token(vault_instance, data)
+                token = Token(vault_instance, data, keep_raw_data)
         except (AttributeError, TypeError):
             vault_instance._logger.error('Response for token seems broken, got :%s', data)
         return token
 
 
-class Token:  # pylint: disable=too-many-public-methods
-    """Models a vault token and provides delete capabilities."""
+class Token:  # pylint: disable=too-many-public-methods,too-many-instance-attributes
+    """Models a vault token and provides delete capabilities.
+
+    All fields are decoded once on creation so the response is only kept if keep_raw_data is set.
+
+    """
 
-    def __init__(self, vault_instance, data):
+    _response_fields = ('auth', 'lease_duration', 'lease_id', 'renewable', 'request_id', 'warnings', 'wrap_info')
+    _token_fields = ('accessor', 'creation_time', 'creation_ttl', 'display_name', 'expire_time', 'issue_time',
+                     'explicit_max_ttl', 'id', 'meta', 'num_uses', 'orphan', 'path', 'policies', 'ttl')
+    __slots__ = ('_vault', '_data', '_expire_time_parsed', '_issue_time_parsed',
+                 '_auth', '_lease_duration', '_lease_id', '_renewable', '_request_id', '_warnings', '_wrap_info',
+                 '_accessor', '_creation_time', '_creation_ttl', '_display_name', '_expire_time', '_issue_time',
+                 '_explicit_max_ttl', '_id', '_meta', '_num_uses', '_orphan', '_path', '_policies', '_ttl')
+
+    def __init__(self, vault_instance, data, keep_raw_data=False):
         self._vault = vault_instance
-        self._data = data
+        self._data = data if keep_raw_data else None
+        self._auth = data.get('auth')
+        self._lease_duration = data.get('lease_duration')
+        self._lease_id = data.get('lease_id')
+        self._renewable = data.get('renewable')
+        self._request_id = data.get('request_id')
+        self._warnings = data.get('warnings')
+        self._wrap_info = data.get('wrap_info')
+        token_data = data.get('data') or {}
+        self._accessor = token_data.get('accessor')
+        self._creation_time = token_data.get('creation_time')
+        self._creation_ttl = token_data.get('creation_ttl')
+        self._display_name = token_data.get('display_name') or ''
+        self._expire_time = token_data.get('expire_time')
+        self._issue_time = token_data.get('issue_time')
+        self._explicit_max_ttl = token_data.get('explicit_max_ttl')
+        self._id = token_data.get('id')
+        self._meta = token_data.get('meta')
+        self._num_uses = token_data.get('num_uses')
+        self._orphan = token_data.get('orphan')
+        self._path = token_data.get('path')
+        self._policies = token_data.get('policies') or []
+        self._ttl = token_data.get('ttl')
+        self._expire_time_parsed = self._issue_time_parsed = _UNPARSED
 
     @property
     def raw_data(self):
         """The raw data of the token.
 
         Returns:
-            dict: The raw data of the token
+            dict: The raw data of the token, rebuilt from the decoded fields if it was not kept
 
         """
-        return self._data
+        if self._data is not None:
+            return self._data
+        data = {field: getattr(self, '_{}'.format(field)) for field in self._response_fields}
+        data['data'] = {field: getattr(self, '_{}'.format(field)) for field in self._token_fields}
+        return data
 
     @property
     def auth(self):
@@ -281,7 +1579,15 @@ class Token:  # pylint: disable=too-many-public-methods
             The auth data
 
         """
-        return self._data.get('auth')
+        return self._auth
+
+    @staticmethod
+    def _parse_time(value):
+        try:
+            date_ = parse_time(value)
+        except (ValueError, TypeError):
+            date_ = None
+        return date_
 
     @staticmethod
     def _seconds_to_day_format(seconds_):
@@ -295,7 +1601,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The duration of the lease of the token
 
         """
-        return self._data.get('lease_duration')
+        return self._lease_duration
 
     @property
     def lease_id(self):
@@ -305,7 +1611,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The lease ID
 
         """
-        return self._data.get('lease_id')
+        return self._lease_id
 
     @property
     def renewable(self):
@@ -315,7 +1621,7 @@ class Token:  # pylint: disable=too-many-public-methods
             bool: True if token is renewable, False otherwise
 
         """
-        return self._data.get('renewable')
+        return self._renewable
 
     @property
     def request_id(self):
@@ -325,7 +1631,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The id of the request for the token
 
         """
-        return self._data.get('request_id')
+        return self._request_id
 
     @property
     def warnings(self):
@@ -335,7 +1641,7 @@ class Token:  # pylint: disable=too-many-public-methods
             The warnings of the token
 
         """
-        return self._data.get('warnings')
+        return self._warnings
 
     @property
     def wrap_info(self):
@@ -345,7 +1651,7 @@ class Token:  # pylint: disable=too-many-public-methods
             The wrap info of the token
 
         """
-        return self._data.get('wrap_info')
+        return self._wrap_info
 
     @property
     def accessor(self):
@@ -355,7 +1661,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The accessor token of the token
 
         """
-        return self._data.get('data', {}).get('accessor')
+        return self._accessor
 
     @property
     def creation_time(self):
@@ -365,7 +1671,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The creation time of the token in seconds
 
         """
-        return self._data.get('data', {}).get('creation_time')
+        return self._creation_time
 
     @property
     def creation_time_day_format(self):
@@ -385,7 +1691,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The creation ttl of the token in seconds
 
         """
-        return self._data.get('data', {}).get('creation_ttl')
+        return self._creation_ttl
 
     @property
     def creation_ttl_day_format(self):
@@ -405,7 +1711,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The display name of the token
 
         """
-        return self._data.get('data', {}).get('display_name', '')
+        return self._display_name
 
     @property
     def expire_time(self):
@@ -415,11 +1721,9 @@ class Token:  # pylint: disable=too-many-public-methods
             datetime: The expire time of the token if any, None otherwise
 
         """
-        try:
-            date_ = parse(self._data.get('data', {}).get('expire_time'))
-        except (ValueError, TypeError):
-            date_ = None
-        return date_
+        if self._expire_time_parsed is _UNPARSED:
+            self._expire_time_parsed = self._parse_time(self._expire_time)
+        return self._expire_time_parsed
 
     @property
     def issue_time(self):
@@ -429,11 +1733,9 @@ class Token:  # pylint: disable=too-many-public-methods
             datetime: The issue time of the token
 
         """
-        try:
-            date_ = parse(self._data.get('data', {}).get('issue_time'))
-        except (ValueError, TypeError):
-            date_ = None
-        return date_
+        if self._issue_time_parsed is _UNPARSED:
+            self._issue_time_parsed = self._parse_time(self._issue_time)
+        return self._issue_time_parsed
 
     @property
     def explicit_max_ttl(self):
@@ -443,7 +1745,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The explicit max ttl
 
         """
-        return self._data.get('data', {}).get('explicit_max_ttl')
+        return self._explicit_max_ttl
 
     @property
     def explicit_max_ttl_day_format(self):
@@ -463,7 +1765,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The id of the token
 
         """
-        return self._data.get('data', {}).get('id')
+        return self._id
 
     @property
     def meta(self):
@@ -473,7 +1775,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The meta of the token
 
         """
-        return self._data.get('data', {}).get('meta')
+        return self._meta
 
     @property
     def num_uses(self):
@@ -483,7 +1785,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The number of uses of the token
 
         """
-        return self._data.get('data', {}).get('num_uses')
+        return self._num_uses
 
     @property
     def orphan(self):
@@ -493,7 +1795,7 @@ class Token:  # pylint: disable=too-many-public-methods
             bool: True if the token is orphan, False otherwise
 
         """
-        return self._data.get('data', {}).get('orphan')
+        return self._orphan
 
     @property
     def path(self):
@@ -503,7 +1805,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The path to create the token
 
         """
-        return self._data.get('data', {}).get('path')
+        return self._path
 
     @property
     def policies(self):
@@ -513,7 +1815,7 @@ class Token:  # pylint: disable=too-many-public-methods
             list: The policies of the token
 
         """
-        return self._data.get('data', {}).get('policies', [])
+        return self._policies
 
     @property
     def ttl(self):
@@ -523,7 +1825,7 @@ class Token:  # pylint: disable=too-many-public-methods
             string: The ttl is seconds
 
         """
-        return self._data.get('data', {}).get('ttl')
+        return self._ttl
 
     @property
     def ttl_day_format(self):
@@ -536,14 +1838,26 @@ class Token:  # pylint: disable=too-many-public-methods
         return self._seconds_to_day_format(self.ttl)
 
     def delete(self):
-        """Deletes the token by removing the accessor from the vault instance."""
-        self._vault.revoke_token(self.accessor, accessor=True)
+        """Deletes the token by removing the accessor from the vault instance.
+
+        Returns:
+            The response of the revocation, an awaitable for tokens of an AsyncVault
+
+        """
+        return self._vault.revoke_token(self.accessor, accessor=True)
 
 
 class BrokenToken(Token):
     """Models a broken token with only an accessor ID and errors messages."""
 
+    _response_fields = Token._response_fields + ('errors',)
+    __slots__ = ('_errors',)
+
+    def __init__(self, vault_instance, data, keep_raw_data=False):
+        super().__init__(vault_instance, data, keep_raw_data)
+        self._errors = data.get('errors')
+
     @property
     def errors(self):
         """The errors of the token."""
-        return self._data.get('errors')
+        return self._errors
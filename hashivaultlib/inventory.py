@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: inventory.py
+#
+# Copyright 2018 Costas Tyfoxylos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Token inventory code for hashivaultlib.
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import time
+from collections import defaultdict
+from itertools import compress
+from operator import attrgetter
+
+__author__ = '''Costas Tyfoxylos <ctyfoxylos@schubergphilis.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-05-25'''
+__copyright__ = '''Copyright 2018, Costas Tyfoxylos'''
+__credits__ = ["Costas Tyfoxylos"]
+__license__ = '''MIT'''
+__maintainer__ = '''Costas Tyfoxylos'''
+__email__ = '''<ctyfoxylos@schubergphilis.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+class TokenInventory:
+    """Column oriented snapshot of tokens for fast filtering, grouping and sorting.
+
+    Every column is a list with one entry per token. Times are kept as POSIX timestamps in seconds, None if not set,
+    so that they can be compared without any parsing.
+
+    """
+
+    columns = ('accessor', 'display_name', 'policies', 'path', 'ttl', 'creation_time', 'issue_time', 'expire_time',
+               'explicit_max_ttl', 'num_uses', 'orphan', 'renewable')
+
+    def __init__(self, columns=None):
+        columns = columns or {}
+        self._columns = {name: list(columns.get(name, [])) for name in self.columns}
+        lengths = {len(values) for values in self._columns.values()}
+        if len(lengths) > 1:
+            raise ValueError('All columns should have the same length, got lengths {}'.format(sorted(lengths)))
+
+    @staticmethod
+    def _timestamp(date_):
+        return date_.timestamp() if date_ else None
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        """Builds an inventory from tokens, as yielded by Vault.tokens.
+
+        Broken tokens are skipped.
+
+        Args:
+            tokens: Iterable of Token objects
+
+        Returns:
+            TokenInventory: The inventory of the tokens
+
+        """
+        row = attrgetter(*cls.columns)
+        rows = [row(token) for token in tokens if not getattr(token, 'errors', None)]
+        columns = dict(zip(cls.columns, map(list, zip(*rows)))) if rows else {}
+        for name in ('issue_time', 'expire_time'):
+            columns[name] = [cls._timestamp(date_) for date_ in columns.get(name, [])]
+        return cls(columns)
+
+    def __len__(self):
+        return len(self._columns['accessor'])
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __repr__(self):
+        return '<{name} tokens={count}>'.format(name=self.__class__.__name__, count=len(self))
+
+    def rows(self):
+        """Iterates over the tokens of the inventory as dictionaries.
+
+        Returns:
+            generator: A dictionary of column name to value per token
+
+        """
+        for values in zip(*(self._columns[name] for name in self.columns)):
+            yield dict(zip(self.columns, values))
+
+    def take(self, indices):
+        """Builds a new inventory with the tokens at the provided positions.
+
+        Args:
+            indices: Iterable of positions
+
+        Returns:
+            TokenInventory: The new inventory
+
+        """
+        indices = list(indices)
+        return TokenInventory({name: [values[index] for index in indices] for name, values in self._columns.items()})
+
+    def mask(self, mask):
+        """Builds a new inventory with the tokens for which the mask is true.
+
+        Args:
+            mask: Iterable of booleans, one per token
+
+        Returns:
+            TokenInventory: The new inventory
+
+        """
+        mask = list(mask)
+        return TokenInventory({name: list(compress(values, mask)) for name, values in self._columns.items()})
+
+    def where(self, name, predicate):
+        """Filters the tokens on the values of a single column.
+
+        Args:
+            name: The name of the column
+            predicate: Callable accepting a value of the column and returning whether to keep the token
+
+        Returns:
+            TokenInventory: The new inventory
+
+        """
+        return self.mask(map(predicate, self._columns[name]))
+
+    def with_policy(self, policy):
+        """Filters the tokens that have a policy.
+
+        Args:
+            policy: The name of the policy
+
+        Returns:
+            TokenInventory: The new inventory
+
+        """
+        return self.where('policies', lambda policies: policy in policies)
+
+    def expiring_within(self, seconds, now=None):
+        """Filters the tokens that expire within a number of seconds.
+
+        Args:
+            seconds: The number of seconds, a timedelta is also accepted
+            now: The POSIX timestamp to count from, defaults to the current time
+
+        Returns:
+            TokenInventory: The new inventory
+
+        """
+        seconds = seconds.total_seconds() if hasattr(seconds, 'total_seconds') else seconds
+        limit = (time.time() if now is None else now) + seconds
+        return self.where('expire_time', lambda expire_time: expire_time is not None and expire_time <= limit)
+
+    def sort_by(self, name, reverse=False):
+        """Sorts the tokens on a column, tokens without a value always go last.
+
+        Args:
+            name: The name of the column
+            reverse: Flag on whether to sort in descending order
+
+        Returns:
+            TokenInventory: The new inventory
+
+        """
+        values = self._columns[name]
+        present = sorted((index for index, value in enumerate(values) if value is not None),
+                         key=values.__getitem__,
+                         reverse=reverse)
+        return self.take(present + [index for index, value in enumerate(values) if value is None])
+
+    def _group_indices(self, name):
+        groups = defaultdict(list)
+        for index, value in enumerate(self._columns[name]):
+            keys = value if isinstance(value, list) else [value]
+            for key in keys:
+                groups[key].append(index)
+        return groups
+
+    def group_by(self, name):
+        """Groups the tokens on a column, list columns like policies put a token in the group of every entry.
+
+        Args:
+            name: The name of the column
+
+        Returns:
+            dict: The value of the column to the inventory of its tokens
+
+        """
+        return {key: self.take(indices) for key, indices in self._group_indices(name).items()}
+
+    def count_by(self, name):
+        """Counts the tokens per value of a column, list columns like policies count a token for every entry.
+
+        Args:
+            name: The name of the column
+
+        Returns:
+            dict: The value of the column to the number of its tokens
+
+        """
+        return {key: len(indices) for key, indices in self._group_indices(name).items()}
@@ -33,7 +33,34 @@ Tests for `hashivaultlib` module.
 
 """
 
+import asyncio
+import concurrent.futures
+import gzip
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+from pathlib import PurePosixPath
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+import requests
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 from betamax.fixtures import unittest
+from hvac import Client
+from hvac.api.secrets_engines.kv_v2 import KvV2
+from hvac.exceptions import Forbidden, InternalServerError, InvalidPath, RateLimitExceeded
+
+from hashivaultlib import (AsyncVault, Vault, RestoreReport, TokenCache, TokenInventory, ListingCache,
+                           SecretCache, PersistentCache, ConcurrencyLimiter, RetryPolicy, Checkpoint, BackupWriter,
+                           export_secrets, import_secrets, ArchiveWriter, BackupArchive, export_archive,
+                           BackupManifest)
+from hashivaultlib.checkpoint import WalkProgress
+from hashivaultlib.hashivaultlib import SingleFlight, TokenFactory, parse_time
 
 __author__ = '''Costas Tyfoxylos <ctyfoxylos@schubergphilis.com>'''
 __docformat__ = '''google'''
@@ -63,3 +90,1141 @@ class TestHashivaultlib(unittest.BetamaxTestCase):
         This is where you should tear down what you've setup in setUp before. This method is called after every test.
         """
         pass
+
+
+SECRETS = {'secret/app/database': {'password': 'one'},
+           'secret/app/api': {'key': 'two'},
+           'secret/app/nested/token': {'token': 'three'},
+           'secret/top': {'value': 'four'}}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Backs up the secrets of a FakeServer, getting killed right after writing the third one when part of the compressed
+# stream it is in has reached the file
+KILLED_BACKUP = '''
+import os
+import sys
+from unittest import mock
+from hvac import Client
+from hashivaultlib import BackupWriter, Checkpoint, Vault
+from tests.test_hashivaultlib import SECRETS, FakeServer
+
+server = FakeServer(SECRETS)
+with mock.patch.multiple(Client, list=server.list, read=server.read):
+    vault = Vault('http://127.0.0.1:8200', token='token', max_workers=1)
+    checkpoint = Checkpoint(sys.argv[2], interval=0)
+    writer = BackupWriter(sys.argv[1], checkpoint=checkpoint)
+    for number, secret in enumerate(vault.iter_secrets_from_path('secret', checkpoint=checkpoint), 1):
+        writer.write(secret)
+        if number == 3:
+            writer._stream.flush()
+            os._exit(9)
+'''
+
+
+class FakeServer:
+    """Serves kv v1 and v2 listings, reads and writes from a dictionary in place of vault."""
+
+    def __init__(self, secrets):
+        self.secrets = dict(secrets)
+        self.listed = []
+        self.reads = []
+        self.versions = {}
+        self.deleted = set()
+        self.destroyed = set()
+
+    def list(self, path):
+        self.listed.append(str(path))
+        prefix = str(path).rstrip('/') + '/'
+        keys = sorted({''.join(key[len(prefix):].partition('/')[:2]) for key in self.secrets if key.startswith(prefix)})
+        return {'data': {'keys': keys}} if keys else None
+
+    def read(self, path, wrap_ttl=None):  # pylint: disable=unused-argument
+        self.reads.append(str(path))
+        data = self.secrets.get(str(path))
+        return {'data': dict(data)} if data is not None else None
+
+    def write_data(self, path, *, data=None, wrap_ttl=None):  # pylint: disable=unused-argument
+        self.secrets[str(path)] = data
+
+    def delete(self, path):
+        self.secrets.pop(str(path), None)
+
+    def list_secrets(self, path, mount_point='secret'):
+        response = self.list(PurePosixPath(mount_point, path))
+        if response is None:
+            raise InvalidPath()
+        return response
+
+    def read_secret_version(self, path, version=None, mount_point='secret',  # pylint: disable=unused-argument
+                            raise_on_deleted_version=None):
+        self.reads.append(str(PurePosixPath(mount_point, path)))
+        data = self.secrets.get(str(PurePosixPath(mount_point, path)))
+        if data is None or str(path) in self.deleted | self.destroyed:
+            raise InvalidPath()
+        return {'data': {'data': dict(data), 'metadata': {'version': self.versions.get(str(path), 1)}}}
+
+    def read_secret_metadata(self, path, mount_point='secret'):
+        if str(PurePosixPath(mount_point, path)) not in self.secrets:
+            raise InvalidPath()
+        version = self.versions.get(str(path), 1)
+        deletion_time = '2024-01-01T00:00:00Z' if str(path) in self.deleted else ''
+        return {'data': {'current_version': version,
+                         'updated_time': '2024-01-01T00:00:{:02d}Z'.format(version),
+                         'versions': {str(version): {'deletion_time': deletion_time,
+                                                     'destroyed': str(path) in self.destroyed}}}}
+
+    def delete_latest_version_of_secret(self, path, mount_point='secret'):  # pylint: disable=unused-argument
+        self.deleted.add(str(path))
+
+    def delete_secret_versions(self, path, versions, mount_point='secret'):  # pylint: disable=unused-argument
+        if self.versions.get(str(path), 1) in versions:
+            self.deleted.add(str(path))
+
+    def destroy_secret_versions(self, path, versions, mount_point='secret'):  # pylint: disable=unused-argument
+        if self.versions.get(str(path), 1) in versions:
+            self.destroyed.add(str(path))
+
+    def delete_metadata_and_all_versions(self, path, mount_point='secret'):
+        self.secrets.pop(str(PurePosixPath(mount_point, path)), None)
+
+    def create_or_update_secret(self, path, secret, cas=None, mount_point='secret'):  # pylint: disable=unused-argument
+        self.secrets[str(PurePosixPath(mount_point, path))] = secret
+        self.versions[str(path)] = self.versions.get(str(path), 1) + 1
+
+
+class VaultTestCase(TestCase):
+    """Runs a Vault client against a FakeServer by patching the hvac requests it makes."""
+
+    def setUp(self):
+        self.server = FakeServer(SECRETS)
+        patcher = mock.patch.multiple(Client,
+                                      list=self.server.list,
+                                      read=self.server.read,
+                                      write_data=self.server.write_data,
+                                      delete=self.server.delete)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.multiple(KvV2,
+                                      list_secrets=self.server.list_secrets,
+                                      read_secret_version=self.server.read_secret_version,
+                                      read_secret_metadata=self.server.read_secret_metadata,
+                                      delete_metadata_and_all_versions=self.server.delete_metadata_and_all_versions,
+                                      delete_latest_version_of_secret=self.server.delete_latest_version_of_secret,
+                                      delete_secret_versions=self.server.delete_secret_versions,
+                                      destroy_secret_versions=self.server.destroy_secret_versions,
+                                      create_or_update_secret=self.server.create_or_update_secret)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.vault = self.create_vault()
+        self.addCleanup(self.vault.close)
+
+    @staticmethod
+    def create_vault(**kwargs):
+        return Vault('http://127.0.0.1:8200', token='token', max_workers=2, **kwargs)
+
+
+class TestWalk(VaultTestCase):
+
+    def test_retrieves_every_secret_under_a_path(self):
+        secrets = self.vault.retrieve_secrets_from_path('secret')
+        self.assertEqual({str(secret['original_path']): secret['data'] for secret in secrets}, SECRETS)
+
+    def test_reads_a_path_that_cannot_be_listed_as_a_secret(self):
+        secrets = self.vault.retrieve_secrets_from_path('secret/top')
+        self.assertEqual([(str(secret['original_path']), secret['data']) for secret in secrets],
+                         [('secret/top', {'value': 'four'})])
+
+    def test_skips_secrets_that_disappear_while_walking(self):
+        with mock.patch.object(Client, 'read', return_value=None):
+            self.assertEqual(self.vault.retrieve_secrets_from_path('secret'), [])
+
+    def test_retries_transient_errors(self):
+        vault = self.create_vault(retry_policy=RetryPolicy(backoff=0))
+        self.addCleanup(vault.close)
+        with mock.patch.object(Client, 'read', side_effect=[InternalServerError(), {'data': {'value': 'four'}}]):
+            secrets = vault.retrieve_secrets_from_path('secret/top')
+        self.assertEqual([secret['data'] for secret in secrets], [{'value': 'four'}])
+
+    def test_lists_every_directory_once(self):
+        self.vault.retrieve_secrets_from_path('secret')
+        self.assertEqual(sorted(self.server.listed), ['secret', 'secret/app', 'secret/app/nested'])
+
+    def test_shares_one_worker_pool_across_operations(self):
+        self.vault.retrieve_secrets_from_path('secret')
+        executor = self.vault._executor  # pylint: disable=protected-access
+        self.vault.restore_secrets([{'original_path': 'secret/restored', 'data': {'value': 'five'}}])
+        self.assertIs(self.vault._executor, executor)  # pylint: disable=protected-access
+
+    def test_recreates_the_worker_pool_after_closing(self):
+        with self.create_vault() as vault:
+            vault.retrieve_secrets_from_path('secret')
+        self.assertEqual(len(vault.retrieve_secrets_from_path('secret')), len(SECRETS))
+        vault.close()
+
+
+class TestHttpPool(TestCase):
+
+    def test_keeps_a_connection_alive_per_worker(self):
+        with Vault('http://127.0.0.1:8200', token='token', max_workers=3) as vault:
+            self.assertEqual(vault.session.get_adapter('http://127.0.0.1:8200')._pool_maxsize, 3)  # pylint: disable=protected-access
+
+    def test_leaves_a_session_of_the_caller_untouched(self):
+        session = requests.Session()
+        adapter = session.get_adapter('http://127.0.0.1:8200')
+        with Vault('http://127.0.0.1:8200', token='token', max_workers=3, session=session) as vault:
+            self.assertIs(vault.session.get_adapter('http://127.0.0.1:8200'), adapter)
+
+
+class TestKvV2Walk(VaultTestCase):
+
+    def test_retrieves_every_secret_under_a_path(self):
+        secrets = self.vault.secrets.kv.v2.retrieve_secrets_from_path('app', mount_point='secret')
+        self.assertEqual({str(secret['original_path']): secret['data']['data'] for secret in secrets},
+                         {'app/database': {'password': 'one'},
+                          'app/api': {'key': 'two'},
+                          'app/nested/token': {'token': 'three'}})
+
+    def test_deletes_every_secret_under_a_path(self):
+        self.vault.secrets.kv.v2.delete_path('app', mount_point='secret')
+        self.assertEqual(self.server.secrets, {'secret/top': {'value': 'four'}})
+
+    def test_deletes_without_reading_secrets(self):
+        self.vault.secrets.kv.v2.delete_path('app', mount_point='secret')
+        self.assertEqual(self.server.reads, [])
+
+
+class TestStreaming(VaultTestCase):
+
+    def test_yields_secrets_as_they_are_read(self):
+        secrets = self.vault.iter_secrets_from_path('secret')
+        first = next(secrets)
+        self.assertIn(str(first['original_path']), SECRETS)
+        self.assertEqual(len(list(secrets)), len(SECRETS) - 1)
+
+    def test_yields_kv_v2_secrets_as_they_are_read(self):
+        secrets = self.vault.secrets.kv.v2.iter_secrets_from_path('app', mount_point='secret')
+        self.assertEqual(sorted(str(secret['original_path']) for secret in secrets),
+                         ['app/api', 'app/database', 'app/nested/token'])
+
+
+class TestCheckpoint(VaultTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'checkpoint.json')
+
+    def test_resumes_an_interrupted_walk(self):
+        walk = self.vault.iter_secrets_from_path('secret', checkpoint=Checkpoint(self.path, interval=0))
+        first = [str(next(walk)['original_path']) for _ in range(2)]
+        walk.close()
+        self.assertTrue(os.path.exists(self.path))
+        rest = [str(secret['original_path']) for secret in self.vault.iter_secrets_from_path('secret',
+                                                                                            checkpoint=self.path)]
+        self.assertEqual(set(first + rest), set(SECRETS))
+        self.assertNotIn(first[0], rest)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_resumes_an_interrupted_kv_v2_enumeration(self):
+        keys = self.vault.secrets.kv.v2.iter_keys_from_path('app', mount_point='secret',
+                                                            checkpoint=Checkpoint(self.path, interval=0))
+        first = [str(next(keys)) for _ in range(2)]
+        keys.close()
+        rest = [str(key) for key in self.vault.secrets.kv.v2.iter_keys_from_path('app', mount_point='secret',
+                                                                                   checkpoint=self.path)]
+        self.assertEqual(set(first + rest), {'app/api', 'app/database', 'app/nested/token'})
+        self.assertNotIn(first[0], rest)
+
+    def test_refuses_a_checkpoint_of_another_path(self):
+        walk = self.vault.iter_secrets_from_path('secret', checkpoint=self.path)
+        next(walk)
+        walk.close()
+        with self.assertRaises(ValueError):
+            list(self.vault.iter_secrets_from_path('secret/app', checkpoint=self.path))
+
+    def test_walk_without_checkpoint_remembers_no_secrets(self):
+        progress = WalkProgress(None, 'secret', list, None)
+        progress.complete('secret/top')
+        ready = []
+        progress.schedule(['secret/top'], [], ready)
+        self.assertEqual(ready, ['secret/top'])
+        self.assertFalse(progress.due)
+
+
+class TestRestore(VaultTestCase):
+
+    def test_restores_secrets_to_their_original_path(self):
+        report = self.vault.restore_secrets([{'original_path': 'secret/restored', 'data': {'value': 'five'}}])
+        self.assertTrue(report)
+        self.assertEqual(report.restored, ['secret/restored'])
+        self.assertEqual(self.server.secrets['secret/restored'], {'value': 'five'})
+
+    def test_restores_kv_v2_secrets(self):
+        report = self.vault.secrets.kv.v2.restore_secrets([{'original_path': 'restored',
+                                                            'data': {'data': {'value': 'five'}}}],
+                                                          mount_point='other')
+        self.assertTrue(report)
+        self.assertEqual(self.server.secrets['other/restored'], {'value': 'five'})
+
+    def test_records_secrets_without_original_path_as_failed(self):
+        report = self.vault.restore_secrets([{'data': {'value': 'five'}}])
+        self.assertIsInstance(report, RestoreReport)
+        self.assertFalse(report)
+        self.assertEqual(len(report.failed), 1)
+
+    def test_records_failed_writes(self):
+        with mock.patch.object(Client, 'write_data', side_effect=RuntimeError('denied')):
+            report = self.vault.restore_secrets([{'original_path': 'secret/restored', 'data': {'value': 'five'}}])
+        self.assertEqual([(path, str(error)) for path, error in report.failed], [('secret/restored', 'denied')])
+
+    def test_writes_data_with_keys_named_like_arguments(self):
+        data = {'path': 'one', 'wrap_ttl': 'two', 'retries': 'three', 'operation': 'four', 'function': 'five'}
+        self.assertTrue(self.vault.restore_secrets([{'original_path': 'secret/clash', 'data': data}]))
+        self.assertEqual(self.server.secrets['secret/clash'], data)
+
+    def test_rejects_a_single_secret(self):
+        self.assertFalse(self.vault.restore_secrets({'original_path': 'secret/top', 'data': {}}))
+
+
+class FakeHttpServer:
+    """Serves the kv v1 and v2 and token accessor endpoints of vault over HTTP from a FakeServer."""
+
+    def __init__(self, server, accessors):
+        self.server = server
+        self.accessors = accessors
+        self.app = web.Application()
+        self.app.router.add_route('*', '/v1/{path:.*}', self.handle)
+
+    @staticmethod
+    def kv_v2_path(path):
+        mount_point, _, rest = path.partition('/')
+        engine, _, path_ = rest.partition('/')
+        return engine, str(PurePosixPath(mount_point, path_))
+
+    async def handle(self, request):
+        path = request.match_info['path']
+        if path == 'auth/token/accessors':
+            return web.json_response({'data': {'keys': self.accessors}})
+        if path == 'auth/token/lookup-accessor':
+            accessor = (await request.json())['accessor']
+            return web.json_response({'data': {'accessor': accessor, 'policies': ['default']}})
+        engine, kv_v2_path = self.kv_v2_path(path)
+        if request.query.get('list') == 'true':
+            response = self.server.list(kv_v2_path if engine == 'metadata' else path)
+        elif request.method == 'GET':
+            response = self.server.read(kv_v2_path if engine == 'data' else path)
+            if response and engine == 'data':
+                response = {'data': response}
+        elif request.method == 'POST':
+            data = await request.json()
+            self.server.write_data(kv_v2_path if engine == 'data' else path, data=data.get('data', data))
+            return web.Response(status=204)
+        else:
+            self.server.delete(kv_v2_path if engine == 'metadata' else path)
+            return web.Response(status=204)
+        if response is None:
+            return web.json_response({'errors': []}, status=404)
+        return web.json_response(response)
+
+
+class TokensTestCase(VaultTestCase):
+    """Looks up a few tokens through a patched accessor listing and lookup."""
+
+    def setUp(self):
+        super().setUp()
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.lock = threading.Lock()
+        accessors = mock.patch.object(Vault, '_token_accessors', new_callable=mock.PropertyMock,
+                                      return_value=['one', 'two', 'three', 'four', 'five'])
+        accessors.start()
+        self.addCleanup(accessors.stop)
+        lookup = mock.patch.object(Vault, '_lookup_accessor', side_effect=self.lookup_accessor)
+        self.lookup = lookup.start()
+        self.addCleanup(lookup.stop)
+
+    def lookup_accessor(self, accessor):
+        with self.lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        return {'data': {'accessor': accessor,
+                         'policies': ['default'],
+                         'ttl': 3600,
+                         'creation_time': 1,
+                         'issue_time': '2025-01-01T00:00:00Z',
+                         'expire_time': '2026-01-01T00:00:00Z'}}
+
+
+class TestTokens(TokensTestCase):
+
+    def test_looks_up_every_accessor(self):
+        self.assertEqual(sorted(token.accessor for token in self.vault.tokens), ['five', 'four', 'one', 'three', 'two'])
+
+    def test_keeps_at_most_max_workers_lookups_in_flight(self):
+        list(self.vault.tokens)
+        self.assertLessEqual(self.most_in_flight, 2)
+
+
+class TestTokenCache(TokensTestCase):
+
+    def test_serves_lookups_from_the_cache(self):
+        vault = self.create_vault(token_cache=TokenCache())
+        self.addCleanup(vault.close)
+        list(vault.tokens)
+        list(vault.tokens)
+        self.assertEqual(self.lookup.call_count, 5)
+
+    def test_keeps_the_cache_when_the_accessor_listing_fails(self):
+        cache = TokenCache()
+        vault = self.create_vault(token_cache=cache)
+        self.addCleanup(vault.close)
+        list(vault.tokens)
+        with mock.patch.object(Vault, '_token_accessors', new_callable=mock.PropertyMock, return_value=None):
+            self.assertEqual(list(vault.tokens), [])
+        self.assertEqual(len(cache), 5)
+
+    def test_expires_lookups_with_their_ttl(self):
+        cache = TokenCache()
+        cache.set('accessor', {'data': {'ttl': 60}}, now=1000)
+        self.assertEqual(cache.get('accessor', now=1030)['data']['ttl'], 30)
+        self.assertIsNone(cache.get('accessor', now=1060))
+
+    def test_retains_only_existing_accessors(self):
+        cache = TokenCache()
+        cache.set('kept', {'data': {}})
+        cache.set('gone', {'data': {}})
+        cache.retain(['kept'])
+        self.assertIn('kept', cache)
+        self.assertNotIn('gone', cache)
+
+
+class TestBackup(VaultTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def round_trip(self, name, compression=None):
+        path = os.path.join(self.directory, name)
+        count = export_secrets(self.vault.iter_secrets_from_path('secret'), path, compression)
+        self.assertEqual(count, len(SECRETS))
+        return {secret['original_path']: secret['data'] for secret in import_secrets(path, compression)}
+
+    def test_round_trips_plain_json_lines(self):
+        self.assertEqual(self.round_trip('backup.jsonl'), SECRETS)
+
+    def test_round_trips_gzip_chosen_by_suffix(self):
+        self.assertEqual(self.round_trip('backup.jsonl.gz'), SECRETS)
+        with gzip.open(os.path.join(self.directory, 'backup.jsonl.gz'), 'rt') as backup:
+            self.assertEqual(len(backup.readlines()), len(SECRETS))
+
+    def test_round_trips_zstd_chosen_explicitly(self):
+        self.assertEqual(self.round_trip('backup', compression='zstd'), SECRETS)
+
+    def test_rejects_unknown_compressions(self):
+        with self.assertRaises(ValueError):
+            export_secrets([], os.path.join(self.directory, 'backup'), compression='lzma')
+
+    def test_appends_compressed_streams(self):
+        path = os.path.join(self.directory, 'backup.jsonl.gz')
+        export_secrets([{'original_path': 'secret/one', 'data': {}}], path)
+        export_secrets([{'original_path': 'secret/two', 'data': {}}], path, append=True)
+        self.assertEqual([secret['original_path'] for secret in import_secrets(path)], ['secret/one', 'secret/two'])
+
+    def test_streams_an_import_into_a_restore(self):
+        path = os.path.join(self.directory, 'backup.jsonl.zst')
+        export_secrets(self.vault.iter_secrets_from_path('secret'), path)
+        self.server.secrets.clear()
+        report = self.vault.restore_secrets(import_secrets(path))
+        self.assertEqual(len(report.restored), len(SECRETS))
+        self.assertEqual(self.server.secrets, SECRETS)
+
+    def test_records_the_flushed_offset_of_the_backup_in_the_checkpoint(self):
+        path = os.path.join(self.directory, 'backup.jsonl.gz')
+        checkpoint = Checkpoint(os.path.join(self.directory, 'checkpoint.json'), interval=0)
+        with BackupWriter(path, checkpoint=checkpoint) as writer:
+            walk = self.vault.iter_secrets_from_path('secret', checkpoint=checkpoint)
+            writer.write(next(walk))
+            walk.close()
+            self.assertEqual(checkpoint.offset, os.path.getsize(path))
+            self.assertEqual(len(list(import_secrets(path))), 1)
+
+    def kill_and_resume(self, name):
+        path = os.path.join(self.directory, name)
+        checkpoint_path = os.path.join(self.directory, 'checkpoint.json')
+        process = subprocess.run([sys.executable, '-c', KILLED_BACKUP, path, checkpoint_path],
+                                 cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT), check=False)
+        self.assertEqual(process.returncode, 9)
+        checkpoint = Checkpoint(checkpoint_path, interval=0)
+        self.assertLess(checkpoint.offset, os.path.getsize(path))
+        with BackupWriter(path, checkpoint=checkpoint) as writer:
+            for secret in self.vault.iter_secrets_from_path('secret', checkpoint=checkpoint):
+                writer.write(secret)
+        self.assertEqual(sorted(secret['original_path'] for secret in import_secrets(path)), sorted(SECRETS))
+        self.assertFalse(os.path.exists(checkpoint_path))
+
+    def test_resumes_a_killed_gzip_backup(self):
+        self.kill_and_resume('backup.jsonl.gz')
+
+    def test_resumes_a_killed_zstd_backup(self):
+        self.kill_and_resume('backup.jsonl.zst')
+
+
+class TestBackupArchive(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'backup.archive')
+
+    def export(self, secrets):
+        return export_archive(({'original_path': path, 'data': data} for path, data in secrets.items()), self.path)
+
+    def test_looks_up_single_secrets(self):
+        self.assertEqual(self.export({'secret/b': {'key': 'b'}, 'secret/a': {'key': 'a'}}), 2)
+        with BackupArchive(self.path) as archive:
+            self.assertEqual(len(archive), 2)
+            self.assertEqual(archive.get('secret/a'), {'original_path': 'secret/a', 'data': {'key': 'a'}})
+            self.assertIn('secret/b', archive)
+            self.assertIsNone(archive.get('secret/c'))
+            self.assertEqual(list(archive.paths()), ['secret/a', 'secret/b'])
+
+    def test_keeps_the_last_secret_written_to_a_path(self):
+        with ArchiveWriter(self.path) as writer:
+            writer.write({'original_path': 'secret/a', 'data': {'key': 'old'}})
+            writer.write({'original_path': 'secret/a', 'data': {'key': 'new'}})
+        with BackupArchive(self.path) as archive:
+            self.assertEqual(len(archive), 1)
+            self.assertEqual(archive.get('secret/a')['data'], {'key': 'new'})
+
+    def test_restores_subtrees(self):
+        self.export({'secret/app': {}, 'secret/app/one': {}, 'secret/app/two/three': {}, 'secret/application': {},
+                     'secret/other': {}})
+        with BackupArchive(self.path) as archive:
+            self.assertEqual([secret['original_path'] for secret in archive.subtree('secret/app/')],
+                             ['secret/app', 'secret/app/one', 'secret/app/two/three'])
+            self.assertEqual(len(list(archive.subtree())), 5)
+
+    def test_rejects_archives_of_failed_exports(self):
+        def secrets():
+            yield {'original_path': 'secret/a', 'data': {}}
+            raise InternalServerError('walk failed')
+
+        with self.assertRaises(InternalServerError):
+            export_archive(secrets(), self.path)
+        with self.assertRaisesRegex(ValueError, 'incomplete'):
+            BackupArchive(self.path)
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'w', encoding='utf-8') as file_:
+            file_.write('{}\n')
+        with self.assertRaisesRegex(ValueError, 'not a backup archive'):
+            BackupArchive(self.path)
+
+
+class TestDifferentialBackup(VaultTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.manifest = BackupManifest()
+
+    def backup(self):
+        self.server.reads.clear()
+        changes = self.vault.secrets.kv.v2.iter_changed_secrets_from_path('app', mount_point='secret',
+                                                                          manifest=self.manifest)
+        return {str(secret['original_path']): secret for secret in changes}
+
+    def test_backs_up_every_secret_without_a_manifest(self):
+        self.assertEqual(sorted(self.backup()), ['app/api', 'app/database', 'app/nested/token'])
+        self.assertEqual(len(self.manifest), 3)
+
+    def test_reads_only_changed_secrets(self):
+        self.backup()
+        self.assertEqual(self.backup(), {})
+        self.assertEqual(self.server.reads, [])
+        self.server.create_or_update_secret('app/api', {'key': 'changed'})
+        changes = self.backup()
+        self.assertEqual(list(changes), ['app/api'])
+        self.assertEqual(changes['app/api']['data']['data'], {'key': 'changed'})
+        self.assertEqual(self.server.reads, ['secret/app/api'])
+
+    def test_records_removed_secrets_as_tombstones(self):
+        self.backup()
+        self.server.delete_metadata_and_all_versions('app/api')
+        self.assertEqual(self.backup(), {'app/api': {'original_path': 'app/api', 'deleted': True}})
+        self.assertNotIn('app/api', self.manifest)
+        self.assertEqual(self.backup(), {})
+
+    def test_records_secrets_with_a_deleted_current_version_as_tombstones(self):
+        self.backup()
+        self.server.deleted.add('app/api')
+        with self.assertNoLogs('hashivaultlib.Vault', level='WARNING'):
+            self.assertEqual(self.backup(), {'app/api': {'original_path': 'app/api', 'deleted': True}})
+        self.assertEqual(self.server.reads, [])
+
+    def test_saves_and_loads_manifests(self):
+        self.backup()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'manifest.json')
+            self.assertEqual(len(BackupManifest.load(path)), 0)
+            self.manifest.save(path)
+            self.manifest = BackupManifest.load(path)
+        self.assertEqual(self.backup(), {})
+
+    def test_restores_skip_tombstones(self):
+        report = self.vault.restore_secrets([{'original_path': 'secret/gone', 'deleted': True},
+                                             {'original_path': 'secret/new', 'data': {'key': 'five'}}])
+        self.assertEqual(report.restored, ['secret/new'])
+        self.assertEqual(report.failed, [])
+        self.assertNotIn('secret/gone', self.server.secrets)
+
+    def test_consolidates_full_and_differential_backups_into_an_archive(self):
+        full = [{'original_path': 'app/api', 'data': {'key': 'old'}},
+                {'original_path': 'app/database', 'data': {'password': 'one'}}]
+        differential = [{'original_path': 'app/api', 'data': {'key': 'new'}},
+                        {'original_path': 'app/database', 'deleted': True}]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'backup.archive')
+            export_archive(full + differential, path)
+            with BackupArchive(path) as archive:
+                self.assertEqual(list(archive.paths()), ['app/api'])
+                self.assertEqual(archive.get('app/api')['data'], {'key': 'new'})
+
+
+class TestPersistentCache(VaultTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.sqlite')
+
+    def walk_with_reopened_cache(self):
+        with PersistentCache(self.path) as cache, self.create_vault(listing_cache=cache) as vault:
+            return vault.retrieve_secrets_from_path('secret')
+
+    def test_survives_reopening_without_the_excluded_fields(self):
+        with PersistentCache(self.path) as cache:
+            cache.set('accessor', {'data': {'id': 'secret-token', 'ttl': 0, 'policies': ['default']}})
+            cache.set_listing('secret', ['app/'], now=1000)
+        with PersistentCache(self.path) as cache:
+            self.assertEqual(cache.get('accessor'), {'data': {'ttl': 0, 'policies': ['default']}})
+            self.assertEqual(cache.get_listing('secret', now=1100), ['app/'])
+            self.assertIsNone(cache.get_listing('secret', now=1300))
+
+    def test_serves_listings_to_later_runs(self):
+        self.walk_with_reopened_cache()
+        self.assertEqual(len(self.walk_with_reopened_cache()), len(SECRETS))
+        self.assertEqual(sorted(self.server.listed), ['secret', 'secret/app', 'secret/app/nested'])
+
+    def test_invalidates_listings_on_writes(self):
+        self.walk_with_reopened_cache()
+        with PersistentCache(self.path) as cache, self.create_vault(listing_cache=cache) as vault:
+            vault.restore_secrets([{'original_path': 'secret/app/new', 'data': {'value': 'five'}}])
+        self.assertEqual(len(self.walk_with_reopened_cache()), len(SECRETS) + 1)
+
+
+class TestListingCache(VaultTestCase):
+
+    def test_lists_directories_from_the_cache(self):
+        vault = self.create_vault(listing_cache=ListingCache())
+        self.addCleanup(vault.close)
+        vault.retrieve_secrets_from_path('secret')
+        listed = len(self.server.listed)
+        vault.retrieve_secrets_from_path('secret')
+        self.assertEqual(len(self.server.listed), listed)
+
+    def test_writing_invalidates_the_cached_listings(self):
+        vault = self.create_vault(listing_cache=ListingCache())
+        self.addCleanup(vault.close)
+        vault.retrieve_secrets_from_path('secret')
+        vault.write_data('secret/app/new', data={'value': 'five'})
+        paths = {str(secret['original_path']) for secret in vault.retrieve_secrets_from_path('secret')}
+        self.assertIn('secret/app/new', paths)
+
+    def test_invalidates_ancestors_and_descendants(self):
+        cache = ListingCache()
+        for path in ('secret', 'secret/app', 'secret/app/nested', 'secret/other'):
+            cache.set_listing(path, ['key'])
+        cache.invalidate_listing('secret/app')
+        self.assertIsNone(cache.get_listing('secret'))
+        self.assertIsNone(cache.get_listing('secret/app/nested'))
+        self.assertEqual(cache.get_listing('secret/other'), ['key'])
+
+    def test_evicts_the_least_recently_used(self):
+        cache = ListingCache(max_size=2)
+        cache.set_listing('first', ['key'])
+        cache.set_listing('second', ['key'])
+        cache.get_listing('first')
+        cache.set_listing('third', ['key'])
+        self.assertIsNone(cache.get_listing('second'))
+        self.assertEqual(cache.get_listing('first'), ['key'])
+
+
+class TestSecretCache(VaultTestCase):
+
+    def create_cached_vault(self, **kwargs):
+        vault = self.create_vault(secret_cache=SecretCache(**kwargs))
+        self.addCleanup(vault.close)
+        return vault
+
+    def read(self, vault, path='app/database'):
+        return vault.secrets.kv.v2.read_secret_version(path=path, mount_point='secret')['data']['data']
+
+    def test_serves_fresh_secrets_from_the_cache(self):
+        vault = self.create_cached_vault()
+        vault.secrets.kv.v2.retrieve_secrets_from_path('app', mount_point='secret')
+        vault.secrets.kv.v2.retrieve_secrets_from_path('app', mount_point='secret')
+        self.assertEqual(len(self.server.reads), 3)
+
+    def test_returns_copies_of_the_cached_secrets(self):
+        vault = self.create_cached_vault()
+        self.read(vault)['password'] = 'changed'
+        self.assertEqual(self.read(vault), {'password': 'one'})
+
+    def test_writing_invalidates_the_cached_secret(self):
+        vault = self.create_cached_vault()
+        self.read(vault)
+        vault.secrets.kv.v2.create_or_update_secret(path='app/database', secret={'password': 'new'},
+                                                    mount_point='secret')
+        self.assertEqual(self.read(vault), {'password': 'new'})
+
+    def test_revalidates_stale_secrets_against_the_current_version(self):
+        vault = self.create_cached_vault(ttl=0)
+        self.read(vault)
+        self.read(vault)
+        self.assertEqual(len(self.server.reads), 1)
+        self.server.secrets['secret/app/database'] = {'password': 'elsewhere'}
+        self.server.versions['app/database'] = 2
+        self.assertEqual(self.read(vault), {'password': 'elsewhere'})
+
+    def test_revalidation_drops_secrets_whose_current_version_is_gone(self):
+        for gone in (self.server.deleted, self.server.destroyed):
+            with self.subTest(gone=gone):
+                vault = self.create_cached_vault(ttl=0)
+                self.read(vault)
+                gone.add('app/database')
+                with self.assertRaises(InvalidPath):
+                    self.read(vault)
+                gone.clear()
+
+    def test_deleting_versions_invalidates_the_cached_secret(self):
+        for delete in ('delete_latest_version_of_secret', 'delete_secret_versions', 'destroy_secret_versions'):
+            with self.subTest(delete=delete):
+                vault = self.create_cached_vault()
+                self.read(vault)
+                arguments = {} if delete == 'delete_latest_version_of_secret' else {'versions': [1]}
+                getattr(vault.secrets.kv.v2, delete)(path='app/database', mount_point='secret', **arguments)
+                with self.assertRaises(InvalidPath):
+                    self.read(vault)
+                self.server.deleted.clear()
+                self.server.destroyed.clear()
+
+    def test_reports_stale_entries(self):
+        cache = SecretCache(ttl=0)
+        cache.set('key', {'data': {}})
+        self.assertEqual(cache.get('key'), ({'data': {}}, False))
+        cache.invalidate('key')
+        self.assertEqual(cache.get('key'), (None, False))
+
+
+class TestSingleFlight(TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def function(self):
+        self.calls += 1
+        self.release.wait(5)
+        return {'data': {'value': 'one'}}
+
+    def call_concurrently(self, function, count=4):
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=count) as executor:
+            futures = [executor.submit(self.single_flight.call, 'key', function) for _ in range(count)]
+            time.sleep(0.05)
+            self.release.set()
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except RuntimeError as error:
+                    results.append(error)
+        return results
+
+    def test_shares_one_call_among_concurrent_callers(self):
+        results = self.call_concurrently(self.function)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{'data': {'value': 'one'}}] * 4)
+
+    def test_shares_the_error_of_the_call(self):
+        def fail():
+            self.release.wait(5)
+            raise RuntimeError('sealed')
+        self.assertEqual([str(error) for error in self.call_concurrently(fail)], ['sealed'] * 4)
+
+    def test_calls_again_once_the_call_is_done(self):
+        self.release.set()
+        self.single_flight.call('key', self.function)
+        self.single_flight.call('key', self.function)
+        self.assertEqual(self.calls, 2)
+
+    def test_keeps_results_private_when_the_first_caller_changes_its_own(self):
+        caller = threading.current_thread()
+        changed = threading.Event()
+        followers = []
+
+        def copy(value):
+            if threading.current_thread() is not caller:
+                changed.wait(5)
+            return deepcopy(value)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            def function():
+                followers.extend(executor.submit(self.single_flight.call, 'key', self.function) for _ in range(3))
+                time.sleep(0.05)
+                return {'original_path': 'secret/top'}
+
+            with mock.patch('hashivaultlib.hashivaultlib.deepcopy', side_effect=copy):
+                result = self.single_flight.call('key', function)
+                result['original_path'] = 'restored/top'
+                changed.set()
+                results = [future.result() for future in followers]
+        self.assertEqual(results, [{'original_path': 'secret/top'}] * 3)
+        self.assertEqual(len({id(result) for result in results}), 3)
+        self.assertEqual(self.calls, 0)
+
+    def test_coalesces_identical_reads_of_a_vault(self):
+        vault = Vault('http://127.0.0.1:8200', token='token', coalesce_reads=True)
+        self.addCleanup(vault.close)
+        with mock.patch.object(Client, 'read', side_effect=lambda path: self.function()):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                futures = [executor.submit(vault.read, 'secret/top') for _ in range(4)]
+                time.sleep(0.05)
+                self.release.set()
+        self.assertEqual([future.result() for future in futures], [{'data': {'value': 'one'}}] * 4)
+        self.assertEqual(self.calls, 1)
+
+
+class TestConcurrencyLimiter(VaultTestCase):
+
+    def test_cuts_the_limit_when_vault_is_overloaded(self):
+        limiter = ConcurrencyLimiter(maximum=16, initial=8)
+        for _ in range(8):
+            limiter.record('GET', 0.01)
+        limiter.record('GET', 0.01, overloaded=True)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_compares_latencies_per_operation(self):
+        limiter = ConcurrencyLimiter(maximum=16, initial=16)
+        for _ in range(20):
+            limiter.record('LIST', 0.001)
+            limiter.record('GET', 0.05)
+        self.assertEqual(limiter.limit, 16)
+        self.assertEqual(limiter.latencies['GET'][1], 0.05)
+
+    def test_baseline_recovers_after_its_window(self):
+        limiter = ConcurrencyLimiter(baseline_window=0)
+        limiter.record('GET', 0.01)
+        limiter.record('GET', 0.05)
+        self.assertEqual(limiter.latencies['GET'][1], 0.05)
+
+    def test_measures_every_http_request(self):
+        limiter = mock.Mock(spec=ConcurrencyLimiter, maximum=4, limit=2)
+        vault = self.create_vault(concurrency_limiter=limiter)
+        self.addCleanup(vault.close)
+        adapter = vault.session.get_adapter('http://127.0.0.1:8200')
+        adapter.adapter = mock.Mock(send=mock.Mock(return_value=mock.Mock(status_code=503)))
+        adapter.send(requests.Request('GET', 'http://127.0.0.1:8200/v1/secret/app?list=True').prepare())
+        operation, _ = limiter.record.call_args.args
+        self.assertEqual((operation, limiter.record.call_args.kwargs), ('LIST', {'overloaded': True}))
+
+    def test_walks_within_the_limit(self):
+        vault = self.create_vault(concurrency_limiter=ConcurrencyLimiter(maximum=4))
+        self.addCleanup(vault.close)
+        self.assertEqual(len(vault.retrieve_secrets_from_path('secret')), len(SECRETS))
+
+
+class TestRetryPolicy(TestCase):
+
+    def test_repeats_only_requests_that_are_safe_to_repeat(self):
+        self.assertTrue(RetryPolicy.is_retryable('read', InternalServerError()))
+        self.assertFalse(RetryPolicy.is_retryable('write', InternalServerError()))
+        self.assertTrue(RetryPolicy.is_retryable('write', RateLimitExceeded()))
+
+    def test_retries_transient_errors(self):
+        request = mock.Mock(side_effect=[InternalServerError(), {'data': {}}])
+        self.assertEqual(RetryPolicy(backoff=0).call('read', request), {'data': {}})
+        self.assertEqual(request.call_count, 2)
+
+    def test_stops_retrying_when_the_budget_is_spent(self):
+        request = mock.Mock(side_effect=InternalServerError())
+        with self.assertRaises(InternalServerError):
+            RetryPolicy(backoff=0, budget=1, budget_ratio=0).call('read', request)
+        self.assertEqual(request.call_count, 2)
+
+    def test_retries_coroutines_with_the_same_budget(self):
+        policy = RetryPolicy(backoff=0, budget=1, budget_ratio=0)
+        request = mock.AsyncMock(side_effect=[InternalServerError(), {'data': {}}])
+        self.assertEqual(asyncio.run(policy.call_async('read', request)), {'data': {}})
+        with self.assertRaises(InternalServerError):
+            policy.call('read', mock.Mock(side_effect=InternalServerError()))
+
+
+class TestFilterTokens(TokensTestCase):
+
+    def lookup_accessor(self, accessor):
+        response = super().lookup_accessor(accessor)
+        response['data']['display_name'] = 'ldap-{}'.format(accessor) if accessor in ('one', 'two') else 'token'
+        response['data']['policies'] = ['admin'] if accessor in ('one', 'three') else ['default']
+        return response
+
+    def accessors(self, **criteria):
+        return sorted(token.accessor for token in self.vault.filter_tokens(**criteria))
+
+    def test_filters_on_any_of_the_policies(self):
+        self.assertEqual(self.accessors(policies=['admin', 'other']), ['one', 'three'])
+
+    def test_combines_the_criteria(self):
+        self.assertEqual(self.accessors(policies=['admin'], display_name_prefix='ldap-'), ['one'])
+        self.assertEqual(self.accessors(display_name_prefix='ldap-', predicate=lambda token: token.accessor != 'one'),
+                         ['two'])
+
+    def test_never_looks_up_skipped_accessors(self):
+        self.assertEqual(self.accessors(skip_accessors={'one', 'two'}), ['five', 'four', 'three'])
+        self.assertEqual(sorted(call.args[0] for call in self.lookup.call_args_list), ['five', 'four', 'three'])
+
+    def test_stops_looking_up_after_the_limit(self):
+        self.assertEqual(len(self.accessors(limit=1)), 1)
+        self.assertLess(self.lookup.call_count, 5)
+
+
+class TestRevokeTokens(TokensTestCase):
+
+    def setUp(self):
+        super().setUp()
+        revoke = mock.patch.object(Client, 'revoke_token')
+        self.revoke = revoke.start()
+        self.addCleanup(revoke.stop)
+
+    def revoked(self):
+        return sorted(call.args[0] for call in self.revoke.call_args_list)
+
+    def test_revokes_tokens_matching_a_predicate(self):
+        report = self.vault.revoke_tokens(lambda token: token.accessor in ('one', 'two'))
+        self.assertTrue(report)
+        self.assertEqual(sorted(report.revoked), ['one', 'two'])
+        self.assertEqual(sorted(report.skipped), ['five', 'four', 'three'])
+        self.assertEqual(self.revoked(), ['one', 'two'])
+
+    def test_revokes_tokens_and_accessors_without_looking_them_up(self):
+        token = TokenFactory(self.vault, self.lookup_accessor('one'))
+        report = self.vault.revoke_tokens([token, 'two'])
+        self.assertEqual(sorted(report.revoked), ['one', 'two'])
+        self.lookup.assert_not_called()
+
+    def test_retries_revocations_vault_did_not_process(self):
+        self.revoke.side_effect = [RateLimitExceeded(), None]
+        with mock.patch('time.sleep'):
+            report = self.vault.revoke_tokens(['one'])
+        self.assertEqual(report.revoked, ['one'])
+        self.assertEqual(self.revoke.call_count, 2)
+
+    def test_does_not_retry_revocations_vault_may_have_processed(self):
+        self.revoke.side_effect = InternalServerError()
+        report = self.vault.revoke_tokens(['one'])
+        self.assertEqual([accessor for accessor, _ in report.failed], ['one'])
+        self.assertEqual(self.revoke.call_count, 1)
+
+    def test_records_failed_revocations(self):
+        self.revoke.side_effect = Forbidden('permission denied')
+        report = self.vault.revoke_tokens(['one'])
+        self.assertFalse(report)
+        self.assertEqual([accessor for accessor, _ in report.failed], ['one'])
+
+    def test_skips_tokens_gone_since_the_accessors_were_listed(self):
+        responses = {'one': {'errors': ['1 error occurred:\n\t* invalid accessor\n\n']}, 'two': {}}
+
+        def lookup(accessor):
+            return responses[accessor] if accessor in responses else self.lookup_accessor(accessor)
+
+        self.lookup.side_effect = lookup
+        report = self.vault.revoke_tokens(lambda token: True)
+        self.assertTrue(report)
+        self.assertEqual(sorted(report.skipped), ['one', 'two'])
+        self.assertEqual(self.revoked(), ['five', 'four', 'three'])
+
+    def test_records_failed_lookups(self):
+        self.lookup.side_effect = lambda accessor: {'errors': ['permission denied']}
+        report = self.vault.revoke_tokens(lambda token: True)
+        self.assertFalse(report)
+        self.assertEqual(len(report.failed), 5)
+        self.assertEqual(report.skipped, [])
+
+    def test_records_a_failed_accessor_listing(self):
+        with mock.patch.object(Vault, '_token_accessors', new_callable=mock.PropertyMock, return_value=None):
+            report = self.vault.revoke_tokens(lambda token: True)
+        self.assertFalse(report)
+        self.assertEqual([accessor for accessor, _ in report.failed], [None])
+
+
+class TestToken(TestCase):
+
+    response = {'request_id': 'request',
+                'data': {'accessor': 'one',
+                         'policies': ['default'],
+                         'ttl': 3600,
+                         'issue_time': '2025-01-01T00:00:00Z',
+                         'expire_time': '2026-01-01T00:00:00.123456789Z'}}
+
+    def test_has_no_instance_dictionary(self):
+        token = TokenFactory(mock.Mock(keep_raw_token_data=False), self.response)
+        self.assertFalse(hasattr(token, '__dict__'))
+        self.assertEqual((token.accessor, token.policies, token.display_name), ('one', ['default'], ''))
+
+    def test_rebuilds_raw_data_from_decoded_fields(self):
+        token = TokenFactory(mock.Mock(keep_raw_token_data=False), self.response)
+        self.assertEqual(token.raw_data['request_id'], 'request')
+        self.assertEqual(token.raw_data['data']['accessor'], 'one')
+
+    def test_keeps_raw_data_when_asked(self):
+        token = TokenFactory(mock.Mock(keep_raw_token_data=True), self.response)
+        self.assertIs(token.raw_data, self.response)
+
+    def test_parses_times_once(self):
+        token = TokenFactory(mock.Mock(keep_raw_token_data=False), self.response)
+        self.assertEqual(token.expire_time, datetime(2026, 1, 1, 0, 0, 0, 123456, tzinfo=timezone.utc))
+        self.assertIs(token.expire_time, token.expire_time)
+        self.assertEqual(token.issue_time.year, 2025)
+
+    def test_decodes_errors_of_broken_tokens(self):
+        token = TokenFactory(mock.Mock(keep_raw_token_data=False), {'errors': ['invalid accessor']})
+        self.assertEqual(token.errors, ['invalid accessor'])
+        self.assertIsNone(token.accessor)
+
+
+class TestParseTime(TestCase):
+
+    def test_parses_utc_times(self):
+        self.assertEqual(parse_time('2026-01-01T10:20:30Z'), datetime(2026, 1, 1, 10, 20, 30, tzinfo=timezone.utc))
+
+    def test_truncates_nanoseconds_to_microseconds(self):
+        self.assertEqual(parse_time('2026-01-01T10:20:30.123456789Z').microsecond, 123456)
+
+    def test_parses_offsets(self):
+        self.assertEqual(parse_time('2026-01-01T10:20:30.5+02:00'),
+                         datetime(2026, 1, 1, 8, 20, 30, 500000, tzinfo=timezone.utc))
+
+    def test_falls_back_to_dateutil_for_other_formats(self):
+        self.assertEqual(parse_time('1 January 2026'), datetime(2026, 1, 1))
+
+    def test_rejects_invalid_times(self):
+        with self.assertRaises(ValueError):
+            parse_time('not a time')
+
+
+class TestTokenInventory(TestCase):
+
+    def setUp(self):
+        vault = mock.Mock(keep_raw_token_data=False)
+        tokens = [TokenFactory(vault, {'data': {'accessor': 'one', 'policies': ['default', 'admin'], 'ttl': 60,
+                                                'expire_time': '2026-01-01T00:01:00Z'}}),
+                  TokenFactory(vault, {'data': {'accessor': 'two', 'policies': ['default'], 'ttl': 3600,
+                                                'expire_time': '2026-01-01T01:00:00Z'}}),
+                  TokenFactory(vault, {'data': {'accessor': 'root', 'policies': ['root'], 'ttl': 0}}),
+                  TokenFactory(vault, {'errors': ['invalid accessor']})]
+        self.inventory = TokenInventory.from_tokens(tokens)
+        self.now = datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp()
+
+    def test_skips_broken_tokens(self):
+        self.assertEqual(self.inventory['accessor'], ['one', 'two', 'root'])
+
+    def test_filters_on_policies(self):
+        self.assertEqual(self.inventory.with_policy('default')['accessor'], ['one', 'two'])
+
+    def test_filters_on_expiry(self):
+        self.assertEqual(self.inventory.expiring_within(600, now=self.now)['accessor'], ['one'])
+        self.assertEqual(self.inventory.expiring_within(timedelta(hours=1), now=self.now)['accessor'], ['one', 'two'])
+
+    def test_sorts_tokens_without_value_last(self):
+        self.assertEqual(self.inventory.sort_by('expire_time', reverse=True)['accessor'], ['two', 'one', 'root'])
+
+    def test_groups_and_counts_on_every_policy(self):
+        self.assertEqual(self.inventory.group_by('policies')['default']['accessor'], ['one', 'two'])
+        self.assertEqual(self.inventory.count_by('policies'), {'default': 2, 'admin': 1, 'root': 1})
+
+    def test_rejects_columns_of_different_lengths(self):
+        with self.assertRaises(ValueError):
+            TokenInventory({'accessor': ['one'], 'ttl': []})
+
+    def test_builds_the_inventory_of_a_vault(self):
+        vault = Vault('http://127.0.0.1:8200', token='token')
+        self.addCleanup(vault.close)
+        tokens = [TokenFactory(vault, {'data': {'accessor': 'one'}})]
+        with mock.patch.object(Vault, 'tokens', new_callable=mock.PropertyMock, return_value=tokens):
+            self.assertEqual([row['accessor'] for row in vault.token_inventory.rows()], ['one'])
+
+
+class TestAsyncVault(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = FakeServer(SECRETS)
+        http_server = TestServer(FakeHttpServer(self.server, ['one', 'two']).app)
+        await http_server.start_server()
+        self.addAsyncCleanup(http_server.close)
+        self.vault = AsyncVault(str(http_server.make_url('')), token='token', max_workers=2)
+        self.addAsyncCleanup(self.vault.close)
+
+    async def test_retrieves_every_secret_under_a_path(self):
+        secrets = await self.vault.retrieve_secrets_from_path('secret')
+        self.assertEqual({str(secret['original_path']): secret['data'] for secret in secrets}, SECRETS)
+
+    async def test_retrieves_every_kv_v2_secret_under_a_path(self):
+        secrets = await self.vault.retrieve_secrets_from_path_v2('app', mount_point='secret')
+        self.assertEqual(sorted(str(secret['original_path']) for secret in secrets),
+                         ['app/api', 'app/database', 'app/nested/token'])
+
+    async def test_deletes_every_secret_under_a_path(self):
+        await self.vault.delete_path('secret/app')
+        self.assertEqual(self.server.secrets, {'secret/top': {'value': 'four'}})
+
+    async def test_deletes_kv_v2_secrets_without_reading_them(self):
+        await self.vault.delete_path_v2('app', mount_point='secret')
+        self.assertEqual(self.server.secrets, {'secret/top': {'value': 'four'}})
+        self.assertEqual(self.server.reads, [])
+
+    async def test_restores_secrets_reporting_each_one(self):
+        report = await self.vault.restore_secrets([{'original_path': 'secret/restored', 'data': {'value': 'five'}},
+                                                   {'data': {'value': 'six'}}])
+        self.assertEqual(report.restored, ['secret/restored'])
+        self.assertEqual(len(report.failed), 1)
+        self.assertEqual(self.server.secrets['secret/restored'], {'value': 'five'})
+
+    async def test_restores_kv_v2_secrets(self):
+        report = await self.vault.restore_secrets_v2([{'original_path': 'restored',
+                                                       'data': {'data': {'value': 'five'}}}],
+                                                     mount_point='other')
+        self.assertTrue(report)
+        self.assertEqual(self.server.secrets['other/restored'], {'value': 'five'})
+
+    async def test_retries_transient_errors(self):
+        self.vault.retry_policy = RetryPolicy(backoff=0)
+        with mock.patch.object(self.vault, '_send', side_effect=[InternalServerError(), {'data': {'value': 'four'}}]):
+            self.assertEqual(await self.vault.read('secret/top'), {'data': {'value': 'four'}})
+
+    async def test_raises_connection_errors_like_the_synchronous_client(self):
+        vault = AsyncVault('http://127.0.0.1:1', token='token', retry_policy=RetryPolicy(retries=0))
+        self.addAsyncCleanup(vault.close)
+        with self.assertRaises(requests.ConnectionError):
+            await vault.read('secret/top')
+
+    async def test_looks_up_every_accessor(self):
+        self.assertEqual(sorted([token.accessor async for token in self.vault.tokens]), ['one', 'two'])